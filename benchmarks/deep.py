@@ -0,0 +1,68 @@
+"""Measure how long it takes to prettify deeply nested documents
+
+For each prettifier and depth it reports the time needed to parse
+and to render a synthetic document made of nested elements,
+each one containing some text and an attribute.
+The document has no whitespace, so that the size of the output
+does not grow with the indentation.
+
+Usage:
+
+    python benchmarks/deep.py [--depths DEPTHS] [--runs RUNS]
+"""
+
+from argparse import ArgumentParser
+from time import perf_counter
+from zpretty.prettifier import ZPrettifier
+from zpretty.xml import XMLPrettifier
+from zpretty.zcml import ZCMLPrettifier
+
+PRETTIFIERS = (ZPrettifier, XMLPrettifier, ZCMLPrettifier)
+
+
+def deep_document(depth):
+    """Return a document with depth nested elements"""
+    return "".join(
+        (
+            '<div class="level">text' * depth,
+            "<span>leaf</span>",
+            "</div>" * depth,
+        )
+    )
+
+
+def timings(prettifier, text):
+    """Return the time needed to parse and render text in milliseconds"""
+    start = perf_counter()
+    instance = prettifier(text=text)
+    parsed = perf_counter()
+    instance()
+    rendered = perf_counter()
+    return (parsed - start) * 1000, (rendered - parsed) * 1000
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument(
+        "--depths",
+        type=lambda value: [int(depth) for depth in value.split(",")],
+        default=[100, 1000, 10000],
+        help="Comma separated list of depths (default: 100,1000,10000)",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    for depth in args.depths:
+        text = deep_document(depth)
+        for prettifier in PRETTIFIERS:
+            results = [timings(prettifier, text) for _ in range(args.runs)]
+            parse = min(result[0] for result in results)
+            render = min(result[1] for result in results)
+            print(
+                f"{prettifier.__name__:<16} depth {depth:>6}   "
+                f"parse {parse:10.1f} ms   render {render:10.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
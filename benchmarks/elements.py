@@ -0,0 +1,69 @@
+"""Measure the time and the memory needed to render many elements
+
+For each prettifier it reports the time needed to render a synthetic
+document with many nodes (tags, texts and comments) and the memory
+that is still allocated after rendering it, when the pretty elements
+wrapping the nodes are kept alive by the prettifier.
+
+Usage:
+
+    python benchmarks/elements.py [--nodes NODES] [--runs RUNS]
+"""
+
+from argparse import ArgumentParser
+from time import perf_counter
+from zpretty.prettifier import ZPrettifier
+from zpretty.xml import XMLPrettifier
+from zpretty.zcml import ZCMLPrettifier
+
+import tracemalloc
+
+PRETTIFIERS = (ZPrettifier, XMLPrettifier, ZCMLPrettifier)
+ITEM = '  <li class="item">Item <b>bold</b><!-- note --></li>\n'
+NODES_PER_ITEM = 6
+
+
+def wide_document(nodes):
+    """Return a document with about the given number of nodes"""
+    return f"<ul>\n{ITEM * (nodes // NODES_PER_ITEM)}</ul>\n"
+
+
+def render_time(prettifier, text):
+    """Return the time needed to render text in milliseconds"""
+    instance = prettifier(text=text)
+    start = perf_counter()
+    instance()
+    return (perf_counter() - start) * 1000
+
+
+def render_memory(prettifier, text):
+    """Return the memory allocated by rendering text in MiB"""
+    instance = prettifier(text=text)
+    tracemalloc.start()
+    try:
+        rendered = instance()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del rendered
+    return current / 2**20
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    text = wide_document(args.nodes)
+    for prettifier in PRETTIFIERS:
+        render = min(render_time(prettifier, text) for _ in range(args.runs))
+        memory = render_memory(prettifier, text)
+        print(
+            f"{prettifier.__name__:<16} nodes {args.nodes:>8}   "
+            f"render {render:10.1f} ms   memory {memory:8.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Measure the time spent escaping texts and attribute values
+
+The corpus is made of the sample files used by the tests,
+each one repeated until it is about as big as a real world template
+(100 kB by default).
+For each sample it reports:
+
+- the time needed to render it
+- the time needed to escape all its texts and attribute values
+  with the zpretty fast path and by always calling the escaping functions
+
+Usage:
+
+    python benchmarks/escaping.py [--size SIZE] [--runs RUNS]
+"""
+
+from argparse import ArgumentParser
+from html import escape
+from importlib.resources import files
+from time import perf_counter
+from zpretty.prettifier import ZPrettifier
+from zpretty.xml import XMLPrettifier
+from zpretty.zcml import ZCMLPrettifier
+
+SAMPLES = (
+    ("sample_html.html", ZPrettifier),
+    ("sample_html4.html", ZPrettifier),
+    ("sample_pt.pt", ZPrettifier),
+    ("sample_xml.xml", XMLPrettifier),
+    ("sample.zcml", ZCMLPrettifier),
+)
+
+
+def corpus_text(filename, size):
+    """Return the sample content repeated to be about size characters long
+
+    If the sample has a root element, only its content is repeated
+    """
+    text = (files("zpretty.tests") / "original" / filename).read_text()
+    times = max(1, size // len(text))
+    head, root, body = text.partition("<root>")
+    if not root:
+        return text * times
+    content, end, tail = body.rpartition("</root>")
+    return f"{head}{root}{content * times}{end}{tail}"
+
+
+def collect(element):
+    """Return the text elements and the attribute values below element"""
+    texts = []
+    values = []
+    stack = [element]
+    while stack:
+        element = stack.pop()
+        if element.is_text():
+            texts.append(element)
+        for value in element.attributes.attributes.values():
+            values.append(" ".join(value) if isinstance(value, list) else value)
+        stack.extend(element.getchildren())
+    return texts, values
+
+
+def best(function, runs):
+    """Return the best time of function in milliseconds"""
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for filename, prettifier in SAMPLES:
+        text = corpus_text(filename, args.size)
+        render = best(lambda: prettifier(text=text)(), args.runs)
+        texts, values = collect(prettifier(text=text).root)
+        escaper = prettifier.pretty_element.escaper
+        if prettifier is ZPrettifier:
+            substitute = escaper.substitute_html
+        else:
+            substitute = escaper.substitute_xml
+        attributes = prettifier.pretty_element.attribute_klass({})
+
+        def fast_path():
+            for element in texts:
+                element.text
+            for value in values:
+                attributes.maybe_escape("", value)
+
+        def always_escape():
+            for element in texts:
+                substitute(element.context.string)
+            for value in values:
+                escape(value, quote=False)
+
+        print(
+            f"{filename:<24} {len(text):>8} chars   render {render:8.1f} ms   "
+            f"escape {best(fast_path, args.runs):6.2f} ms "
+            f"(always escaping {best(always_escape, args.runs):6.2f} ms)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Measure the time needed to render a big XML file with many processes
+
+The document looks like a GenericSetup export with many objects
+below its document element.
+For each number of jobs it reports the time needed to render it
+(the children of the document element are rendered in parallel
+when there is more than one job) and the speedup over a single job.
+The time needed to parse the document is reported separately,
+because it does not change with the number of jobs.
+
+Usage:
+
+    python benchmarks/sharding.py [--objects OBJECTS] [--jobs JOBS] [--runs RUNS]
+"""
+
+from argparse import ArgumentParser
+from os import cpu_count
+from time import perf_counter
+from zpretty.xml import XMLPrettifier
+
+OBJECT = (
+    '<object name="item{0}" meta_type="Folder">'
+    '<property name="title" type="string">Item {0} &amp; more</property>'
+    '<property name="ids" type="lines">'
+    '<element value="a"/><element value="b"/>'
+    "</property>"
+    "</object>\n"
+)
+
+
+def export(objects):
+    """Return a GenericSetup like export with the given number of objects"""
+    content = "".join(OBJECT.format(idx) for idx in range(objects))
+    return f'<?xml version="1.0"?>\n<object name="portal">\n{content}</object>\n'
+
+
+def default_jobs():
+    """Return the powers of two up to the CPU count"""
+    jobs = [1]
+    while jobs[-1] * 2 <= (cpu_count() or 1):
+        jobs.append(jobs[-1] * 2)
+    return jobs
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument("--objects", type=int, default=20000)
+    parser.add_argument(
+        "--jobs",
+        type=lambda value: [int(jobs) for jobs in value.split(",")],
+        default=default_jobs(),
+        help="Comma separated list of job counts (default: powers of 2 up to CPUs)",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    text = export(args.objects)
+    start = perf_counter()
+    XMLPrettifier(text=text)
+    parse = perf_counter() - start
+    print(f"{len(text) / 2**20:.1f} MiB   parse {parse * 1000:10.1f} ms")
+
+    expected = None
+    single = None
+    for jobs in args.jobs:
+        times = []
+        for _ in range(args.runs):
+            prettifier = XMLPrettifier(text=text, jobs=jobs)
+            start = perf_counter()
+            rendered = prettifier()
+            times.append(perf_counter() - start)
+        if expected is None:
+            expected = rendered
+        elif rendered != expected:
+            raise AssertionError(f"The output with {jobs} jobs is different")
+        render = min(times)
+        single = single or render
+        print(
+            f"jobs {jobs:>3}   render {render * 1000:10.1f} ms   "
+            f"speedup {single / render:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Measure how long it takes to start zpretty
+
+It reports:
+
+- the cumulative import time of some zpretty modules
+  (as reported by `python -X importtime`)
+- the wall time needed to run `zpretty --version`
+- the wall time needed to format a small snippet read from the standard input
+
+Usage:
+
+    python benchmarks/startup.py [--runs RUNS]
+"""
+
+from argparse import ArgumentParser
+from statistics import median
+from time import perf_counter
+
+import subprocess
+import sys
+
+RUN_ZPRETTY = "from zpretty.cli import run; run()"
+MODULES = ("zpretty.cli", "zpretty.prettifier", "zpretty.xml", "zpretty.zcml")
+
+
+def import_time(module):
+    """Return the cumulative import time of module in milliseconds"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1000
+    raise ValueError(f"Cannot find the import time of {module}")
+
+
+def wall_time(args, stdin=""):
+    """Return the time needed to run zpretty with args in milliseconds"""
+    start = perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", RUN_ZPRETTY, *args],
+        input=stdin,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return (perf_counter() - start) * 1000
+
+
+def report(label, timings):
+    print(f"{label:<40} min {min(timings):8.1f} ms   median {median(timings):8.1f} ms")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    runs = parser.parse_args().runs
+
+    for module in MODULES:
+        report(f"import {module}", [import_time(module) for _ in range(runs)])
+    report("zpretty --version", [wall_time(["--version"]) for _ in range(runs)])
+    report(
+        "zpretty < snippet.html",
+        [wall_time([], stdin="<div><p>Hello</p></div>") for _ in range(runs)],
+    )
+    report(
+        "zpretty --zcml < snippet.zcml",
+        [
+            wall_time(["--zcml"], stdin="<configure><include package='.' />")
+            for _ in range(runs)
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Measure the memory needed to render a big XML file with and without streaming
+
+The document looks like a GenericSetup export with many objects
+below its document element.
+It is written to a temporary file that is rendered by XMLPrettifier,
+which builds the whole tree before rendering it,
+and by StreamingXMLPrettifier, which reads the file while rendering it.
+For each of them it reports the render time
+and the peak of the memory allocated while rendering (traced in another run).
+
+Usage:
+
+    python benchmarks/streaming.py [--objects OBJECTS] [--runs RUNS]
+"""
+
+from argparse import ArgumentParser
+from os import remove
+from sharding import export
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+from zpretty.xml import XMLPrettifier
+from zpretty.xmlstream import StreamingXMLPrettifier
+
+import tracemalloc
+
+
+def render(prettifier_class, path):
+    """Render path writing the result nowhere, return its length"""
+    return sum(len(piece) for piece in prettifier_class(path).iter_render())
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument("--objects", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with NamedTemporaryFile("w", suffix=".xml", delete=False) as f:
+        f.write(export(args.objects))
+        size = f.tell()
+    try:
+        print(f"{size / 2**20:.1f} MiB")
+        expected = None
+        for prettifier_class in (XMLPrettifier, StreamingXMLPrettifier):
+            times = []
+            for _ in range(args.runs):
+                start = perf_counter()
+                length = render(prettifier_class, f.name)
+                times.append(perf_counter() - start)
+            if expected is None:
+                expected = length
+            elif length != expected:
+                raise AssertionError(f"The output of {prettifier_class} is different")
+            tracemalloc.start()
+            render(prettifier_class, f.name)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(
+                f"{prettifier_class.__name__:>24}   "
+                f"render {min(times) * 1000:10.1f} ms   "
+                f"peak memory {peak / 2**20:8.1f} MiB"
+            )
+    finally:
+        remove(f.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Measure the helpers that strip the first and the last line of a text
+
+For each text size it reports the time needed by the zpretty.text helpers
+and by an implementation that splits and joins all the lines of the text,
+like the helpers originally did.
+
+Usage:
+
+    python benchmarks/text.py [--sizes SIZES] [--number NUMBER]
+"""
+
+from argparse import ArgumentParser
+from timeit import timeit
+from zpretty.text import lstrip_first_line
+from zpretty.text import rstrip_last_line
+
+
+def splitlines_lstrip_first_line(text):
+    """lstrip the first line splitting and joining all the lines"""
+    if text[-1:].isspace():
+        text += " "
+    lines = text.splitlines()
+    lines[0] = lines[0].lstrip()
+    return "\n".join(lines)
+
+
+def splitlines_rstrip_last_line(text):
+    """rstrip the last line splitting and joining all the lines"""
+    if text[-1:].isspace():
+        text += " "
+    lines = text.splitlines()
+    lines[-1] = lines[-1].rstrip()
+    return "\n".join(lines)
+
+
+FUNCTIONS = (
+    lstrip_first_line,
+    splitlines_lstrip_first_line,
+    rstrip_last_line,
+    splitlines_rstrip_last_line,
+)
+
+
+def sample_text(size):
+    """Return a text of about size characters that looks like rendered markup"""
+    line = '  <div class="level">some text</div>\n'
+    return f"  {line * (size // len(line) + 1)}  "
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.partition("\n")[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[100, 10000, 1000000],
+        help="Comma separated list of text sizes (default: 100,10000,1000000)",
+    )
+    parser.add_argument("--number", type=int, default=100)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        text = sample_text(size)
+        for function in FUNCTIONS:
+            elapsed = timeit(lambda: function(text), number=args.number)
+            print(
+                f"{function.__name__:<30} size {size:>8}   "
+                f"{elapsed / args.number * 1e6:12.1f} us"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -33,7 +33,7 @@ setup(
     license="BSD",
     packages=find_packages(),
     python_requires=">=3.10",
-    install_requires=["setuptools", "beautifulsoup4", "lxml"],
+    install_requires=["setuptools", "beautifulsoup4>=4.13", "lxml"],
     extras_require={
         "test": ["pre-commit", "pytest-cov", "pytest"],
         "development": ["zest.releaser", "check-manifest", "pyroma"],
@@ -0,0 +1,4 @@
+from zpretty.formatter import format_text
+from zpretty.formatter import Formatter
+
+__all__ = ["format_text", "Formatter"]
@@ -1,5 +1,6 @@
 from html import escape
 from logging import getLogger
+from zpretty.text import has_escapable_characters
 
 logger = getLogger(__name__)
 
@@ -78,10 +79,34 @@ class PrettyAttributes:
         "i18n:ignore-attributes",
     )
 
+    # The sort keys of the attribute names are cached per class,
+    # the cache is cleared when it grows bigger than this
+    _sort_keys_max_size = 1024
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._build_ranks()
+
+    @classmethod
+    def _build_ranks(cls):
+        """Precompute the tables used to sort the attributes of this class"""
+        tal_ranks = {}
+        prefixed_tal_ranks = {}
+        for idx, name in enumerate(cls._tal_attribute_order):
+            tal_ranks.setdefault(name, 400 + idx)
+            if name.startswith("tal:"):
+                prefixed_tal_ranks.setdefault(name[4:], 400 + idx)
+        # A name matching a tal attribute once prefixed with "tal:" wins
+        tal_ranks.update(prefixed_tal_ranks)
+        cls._tal_ranks = tal_ranks
+        cls._i18n_names = frozenset(cls._i18n_attributes)
+        cls._sort_keys = {}
+
     def __init__(self, attributes, element=None):
         """attributes is a dict like object"""
         self.attributes = attributes
         self.element = element
+        self._rendered = None
 
     def __len__(self):
         return len(self.attributes)
@@ -112,22 +137,35 @@ class PrettyAttributes:
         4. data- attributes
         5. tal attributes
         6. i18n attributes
+
+        The sort key of each name is computed once and then cached
+        in a dict shared by all the instances:
+        when many threads use it, a key can at worst be computed twice
         """
+        sort_keys = self._sort_keys
+        try:
+            return sort_keys[name]
+        except KeyError:
+            pass
+        if len(sort_keys) >= self._sort_keys_max_size:
+            sort_keys.clear()
+        key = sort_keys[name] = (self._rank(name), name)
+        return key
+
+    def _rank(self, name):
+        """Return the rank of the group the attribute name belongs to"""
         if name.startswith("xmlns"):
-            return (0, name)
+            return 0
         if name in ("class", "id"):
-            return (100, name)
+            return 100
         if name.startswith("data"):
-            return (300, name)
-        if "tal:" + name in self._tal_attribute_order:
-            tal_index = self._tal_attribute_order.index("tal:" + name)
-            return (400 + tal_index, name)
-        if name in self._tal_attribute_order:
-            tal_index = self._tal_attribute_order.index(name)
-            return (400 + tal_index, name)
-        if name in self._i18n_attributes:
-            return (900, name)
-        return (200, name)
+            return 300
+        tal_rank = self._tal_ranks.get(name)
+        if tal_rank is not None:
+            return tal_rank
+        if name in self._i18n_names:
+            return 900
+        return 200
 
     def format_multiline(self, name, value):
         """"""
@@ -187,10 +225,12 @@ class PrettyAttributes:
 
     def maybe_escape(self, name, value):
         """Escape the value if needed"""
+        if not has_escapable_characters(value):
+            # Most of the values do not need to be escaped
+            return value
         if self.is_tal_attribute(name):
             # Never escape what we have in tal attributes
             return value
-
         return escape(value, quote=False)
 
     def can_be_valueless(self, name):
@@ -236,6 +276,15 @@ class PrettyAttributes:
         return self().lstrip()
 
     def __call__(self):
+        """Return the attributes rendered as text
+
+        They are rendered only once, the result is reused on the next calls
+        """
+        if self._rendered is None:
+            self._rendered = self.render()
+        return self._rendered
+
+    def render(self):
         """Render the attributes as text
 
         Render and an empty string if no attributes
@@ -252,3 +301,6 @@ class PrettyAttributes:
         else:
             prefix = ""
         return prefix + f"\n{prefix}".join(self.lines())
+
+
+PrettyAttributes._build_ranks()
@@ -0,0 +1,139 @@
+from hashlib import sha256
+from logging import getLogger
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+import json
+import os
+
+logger = getLogger(__name__)
+
+
+def get_cache_dir():
+    """Return the directory where zpretty stores its cache
+
+    It can be set with the ZPRETTY_CACHE_DIR environment variable,
+    otherwise it will be a zpretty folder in the user cache directory
+    (e.g. ~/.cache/zpretty).
+    """
+    cache_dir = os.environ.get("ZPRETTY_CACHE_DIR")
+    if cache_dir:
+        return Path(cache_dir)
+    user_cache_dir = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(user_cache_dir) / "zpretty"
+
+
+def get_digest(path):
+    """Return the hash of the file content"""
+    with open(path, "rb") as f:
+        return sha256(f.read()).hexdigest()
+
+
+class Cache:
+    """Remember which files are already prettified
+
+    There is a cache file for each combination of zpretty version,
+    prettifier class and encoding.
+    It maps the absolute path of the files known to be already prettified
+    to their size, modification time and content hash.
+
+    A file is considered clean if its size and modification time did not change.
+    If only the modification time changed, the content hash is checked.
+
+    When saving, the entries changed by this run are merged
+    with the ones saved in the meantime by other runs,
+    and only the max_entries files marked clean most recently are kept
+    (so the files that do not exist anymore are eventually forgotten).
+    """
+
+    max_entries = 100000
+
+    def __init__(self, cache_dir, version, prettifier, encoding):
+        self.path = Path(cache_dir) / (
+            f"cache.{version}.{prettifier.__name__}.{encoding}.json"
+        )
+        self.entries = self.load()
+        # The entries changed by this run, see save
+        self.updates = {}
+        self.changed = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Load the cache entries from the file system"""
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def save(self):
+        """Save the cache entries to the file system (only if they changed)
+
+        The file is read again just before replacing it,
+        so that the entries saved by the other runs are not lost.
+        """
+        if not self.changed:
+            return
+        entries = self.load()
+        for key, entry in self.updates.items():
+            # Move the entry to the end, see prune
+            entries.pop(key, None)
+            entries[key] = entry
+        self.entries = self.prune(entries)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with NamedTemporaryFile(
+                "w", dir=self.path.parent, delete=False, suffix=".tmp"
+            ) as f:
+                json.dump(self.entries, f)
+            os.replace(f.name, self.path)
+        except OSError:
+            logger.exception("Cannot write the cache file %s", self.path)
+            return
+        self.updates = {}
+        self.changed = False
+
+    def prune(self, entries):
+        """Keep only the max_entries files marked clean most recently"""
+        if len(entries) <= self.max_entries:
+            return entries
+        return dict(list(entries.items())[-self.max_entries :])
+
+    def is_clean(self, path):
+        """Check if we know that path is already prettified"""
+        key = os.path.abspath(path)
+        entry = self.entries.get(key)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            entry = None
+        if entry:
+            size, mtime, digest = entry
+            if stat.st_size == size:
+                if stat.st_mtime == mtime:
+                    self.hits += 1
+                    return True
+                if get_digest(path) == digest:
+                    self.update(key, [size, stat.st_mtime, digest])
+                    self.hits += 1
+                    return True
+        self.misses += 1
+        return False
+
+    def mark_clean(self, path):
+        """Remember that path is already prettified"""
+        stat = os.stat(path)
+        self.update(
+            os.path.abspath(path), [stat.st_size, stat.st_mtime, get_digest(path)]
+        )
+
+    def update(self, key, entry):
+        """Set the entry for key, it will be saved with the others"""
+        # Keep the updates sorted by time, see save
+        self.updates.pop(key, None)
+        self.entries[key] = self.updates[key] = entry
+        self.changed = True
@@ -1,16 +1,232 @@
+from argparse import Action
 from argparse import ArgumentParser
-from importlib.metadata import version
+from argparse import SUPPRESS
+from functools import lru_cache
+from heapq import merge
+from itertools import chain
+from operator import itemgetter
+from os import cpu_count
+from os import remove
+from os import replace
+from os import scandir
+from os import sep
+from os.path import dirname
+from os.path import getsize
+from os.path import isdir
+from os.path import isfile
+from os.path import join
+from os.path import realpath
 from os.path import splitext
-from pathlib import Path
 from sys import stderr
+from sys import stdin
 from sys import stdout
-from zpretty.prettifier import ZPrettifier
-from zpretty.xml import XMLPrettifier
-from zpretty.zcml import ZCMLPrettifier
+from zpretty.formatter import get_prettifier
 
 import re
 
-version = version("zpretty")
+# The zpretty command is run very often (e.g. by pre-commit or by editors),
+# so this module avoids importing at startup the modules that are slow to load:
+# the prettifiers (and with them bs4 and lxml), importlib.metadata,
+# concurrent.futures, pathlib, tempfile, the cache, the client and the server
+# are imported only when needed.
+
+# The port where the zpretty server listens by default
+DEFAULT_PORT = 45485
+
+
+@lru_cache(maxsize=None)
+def get_version():
+    """Return the zpretty version"""
+    from importlib.metadata import version
+
+    return version("zpretty")
+
+
+def __getattr__(name):
+    """Lazily provide the names that this module used to import eagerly"""
+    if name == "version":
+        return get_version()
+    if name == "ZPrettifier":
+        from zpretty.prettifier import ZPrettifier
+
+        return ZPrettifier
+    if name == "XMLPrettifier":
+        from zpretty.xml import XMLPrettifier
+
+        return XMLPrettifier
+    if name == "ZCMLPrettifier":
+        from zpretty.zcml import ZCMLPrettifier
+
+        return ZCMLPrettifier
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class VersionAction(Action):
+    """Like the argparse version action, but the version is computed lazily"""
+
+    def __init__(self, option_strings, dest=SUPPRESS, default=SUPPRESS, help=None):
+        super().__init__(
+            option_strings=option_strings,
+            dest=dest,
+            default=default,
+            nargs=0,
+            help=help,
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        stdout.write(f"zpretty {get_version()}\n")
+        parser.exit()
+
+
+def walk(root, include, exclude, extend_exclude=None):
+    """Yield the files in the root directory that should be prettified
+
+    The files are yielded lazily and sorted like their paths would be.
+    Directories matching the exclude patterns (with a trailing slash)
+    are not visited at all.
+    Like Path.glob("**/*"), symbolic links to directories are not followed.
+    """
+
+    def excluded(path):
+        return exclude.search(path) or (extend_exclude and extend_exclude.search(path))
+
+    def sorted_entries(path):
+        """Return the directories and files in path, sorted by their full path"""
+        try:
+            with scandir(path) as it:
+                entries = []
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entries.append((entry.name + sep if is_dir else entry.name, entry))
+        except OSError:
+            return iter(())
+        entries.sort(key=itemgetter(0))
+        return iter(entries)
+
+    stack = [("" if root == "." else root, sorted_entries(root))]
+    while stack:
+        parent, entries = stack[-1]
+        for key, entry in entries:
+            path = join(parent, entry.name)
+            if key[-1] == sep:
+                if not excluded(path + sep):
+                    stack.append((path, sorted_entries(path)))
+                    break
+            elif entry.is_file() and include.search(path) and not excluded(path):
+                yield path
+        else:
+            stack.pop()
+
+
+def replace_text(path, pieces, only_if_changed=False):
+    """Replace the content of path with the text made joining pieces
+
+    The pieces are written to a temporary file that eventually replaces path,
+    keeping its permissions.
+    If only_if_changed is true, path is not replaced when it has the same content.
+
+    Return True if path has been replaced
+    """
+    from shutil import copymode
+    from tempfile import mkstemp
+
+    # Follow the symbolic links like writing to path would do
+    target = realpath(path)
+    fd, tmp = mkstemp(dir=dirname(target), prefix=".zpretty-")
+    try:
+        with open(fd, "w") as f:
+            f.writelines(pieces)
+        if only_if_changed:
+            from filecmp import cmp
+
+            if cmp(tmp, target, shallow=False):
+                remove(tmp)
+                return False
+        copymode(target, tmp)
+        replace(tmp, target)
+    except BaseException:
+        remove(tmp)
+        raise
+    return True
+
+
+def rewrite(prettifier, path):
+    """Write the text rendered by prettifier in path, if it changed
+
+    The text is rendered in pieces that are compared with the original text:
+    as soon as they differ, the pieces are written to replace path
+    (see replace_text).
+    The prettifiers that do not keep the original text in memory
+    (see StreamingXMLPrettifier) always write the pieces to a temporary file,
+    that replaces path only if the two files differ.
+
+    Return True if the file is already prettified
+    """
+    original = getattr(prettifier, "original_text", None)
+    if original is None:
+        return not replace_text(path, prettifier.iter_render(), only_if_changed=True)
+    pieces = prettifier.iter_render()
+    position = 0
+    for piece in pieces:
+        if not original.startswith(piece, position):
+            pieces = chain((piece,), pieces)
+            break
+        position += len(piece)
+    else:
+        if position == len(original):
+            return True
+    replace_text(path, chain((original[:position],), pieces))
+    return False
+
+
+def prettify(
+    Prettifier,
+    path,
+    encoding="utf8",
+    check=False,
+    inplace=False,
+    stream=False,
+    jobs=1,
+    repairs=None,
+):
+    """Prettify a single path with the given prettifier class
+
+    Return a boolean telling if the file is already prettified
+    when formatting in place (the file is rewritten only if needed),
+    the prettified text otherwise.
+    When checking return True if the file is already prettified,
+    the line and the column of the first difference otherwise.
+    If stream is true, the prettified text is returned as an iterator of pieces.
+    If jobs is greater than 1, the file is rendered by that many processes.
+    If repairs is a dict, it maps path to the list of the tags repaired
+    in the file (see ZPrettifier.repaired_tags),
+    that is complete once the text has been rendered.
+
+    This is a module level function so that it can be run in a worker process.
+    """
+    prettifier = Prettifier(path, encoding=encoding, jobs=jobs)
+    if repairs is not None:
+        repairs[path] = prettifier.repaired_tags
+    if check:
+        return prettifier.first_difference() or True
+    if inplace and not path == "-":
+        return rewrite(prettifier, path)
+    if stream:
+        return prettifier.iter_render()
+    return prettifier()
+
+
+def prettify_in_worker(*args):
+    """Run prettify in a worker process
+
+    Return its result and the tags repaired in the file
+    """
+    repairs = {}
+    result = prettify(*args, repairs=repairs)
+    return result, repairs[args[1]]
 
 
 class CLIRunner:
@@ -22,10 +238,23 @@ class CLIRunner:
         r"\.svn|\.ipynb_checkpoints|_build|buck-out|build|dist|__pypackages__)/"
     )
 
+    # Becomes false if the zpretty server cannot be reached, see --client
+    server_available = True
+
     def __init__(self):
         self.errors = []
+        self.caches = {}
+        # Map the paths to the tags repaired in them, see report_repairs
+        self.repairs = {}
         self.config = self.parser.parse_args()
 
+    @property
+    def cache_dir(self):
+        """The directory where the cache files are stored"""
+        from zpretty.cache import get_cache_dir
+
+        return get_cache_dir()
+
     @property
     def parser(self):
         """The parser we are using to parse the command line arguments"""
@@ -53,8 +282,7 @@ class CLIRunner:
             "-v",
             "--version",
             help="Show zpretty version number",
-            action="version",
-            version=f"zpretty {version}",
+            action=VersionAction,
         )
         parser.add_argument(
             "-x",
@@ -82,6 +310,75 @@ class CLIRunner:
             dest="check",
             default=False,
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            help="Number of files to process in parallel (defaults to the CPU count)",
+            action="store",
+            dest="jobs",
+            type=int,
+            default=cpu_count() or 1,
+        )
+        parser.add_argument(
+            "--split",
+            help=(
+                "Render the elements of each file in parallel using --jobs processes, "
+                "instead of processing many files in parallel (useful for huge files)"
+            ),
+            action="store_true",
+            dest="split",
+            default=False,
+        )
+        parser.add_argument(
+            "--low-memory",
+            help=(
+                "Read the XML files while they are rendered, keeping in memory "
+                "only the elements being written (useful for huge files)"
+            ),
+            action="store_true",
+            dest="low_memory",
+            default=False,
+        )
+        parser.add_argument(
+            "--no-cache",
+            help=(
+                "Do not use the cache of the files known to be already prettified "
+                "when checking or formatting in place"
+            ),
+            action="store_false",
+            dest="cache",
+            default=True,
+        )
+        parser.add_argument(
+            "--serve",
+            help=(
+                "Run a server that formats the texts sent by the zpretty clients "
+                "(see --client)"
+            ),
+            action="store_true",
+            dest="serve",
+            default=False,
+        )
+        parser.add_argument(
+            "--client",
+            help=(
+                "Format the files with the zpretty server, if it is running, "
+                "otherwise in this process"
+            ),
+            action="store_true",
+            dest="client",
+            default=False,
+        )
+        parser.add_argument(
+            "--port",
+            help=(
+                f"The localhost port of the zpretty server (defaults to {DEFAULT_PORT})"
+            ),
+            action="store",
+            dest="port",
+            type=int,
+            default=DEFAULT_PORT,
+        )
         parser.add_argument(
             "--include",
             help=(
@@ -133,25 +430,37 @@ class CLIRunner:
         )
         return parser
 
-    def choose_prettifier(self, path):
-        """Choose the best prettifier given the config and the input file"""
+    def choose_mode(self, path):
+        """Choose the best mode (html, xml or zcml) given the config and the path"""
         config = self.config
-        if config.zcml:
-            return ZCMLPrettifier
-        if config.xml:
-            return XMLPrettifier
         ext = splitext(path)[-1].lower()
-        if ext == ".xml":
-            return XMLPrettifier
-        if ext == ".zcml":
-            return ZCMLPrettifier
-        return ZPrettifier
+        if config.zcml or (not config.xml and ext == ".zcml"):
+            return "zcml"
+        if config.xml or ext == ".xml":
+            return "xml"
+        return "html"
+
+    def choose_prettifier(self, path):
+        """Choose the best prettifier given the config and the input file"""
+        mode = self.choose_mode(path)
+        if mode == "xml" and self.config.low_memory:
+            from zpretty.xmlstream import StreamingXMLPrettifier
+
+            return StreamingXMLPrettifier
+        return get_prettifier(mode)
 
     @property
     def good_paths(self):
         """Return a list of good paths"""
-        good_paths = []
+        return list(self.iter_good_paths())
+
+    def iter_good_paths(self):
+        """Yield the good paths sorted
 
+        The paths passed on the command line are validated upfront,
+        while the directories are walked lazily,
+        so that we can start prettifying before the walk ends.
+        """
         try:
             exclude = re.compile(self.config.exclude)
         except re.error:
@@ -179,50 +488,225 @@ class CLIRunner:
                 f"Invalid regular expression for --include: {self.config.include!r}"
             )
 
+        good_paths = []
+        walkers = []
         for path in self.config.paths:
-            # use Pathlib to check if the file exists and it is a file
             if path == "-":
                 good_paths.append(path)
                 continue
             if exclude.match(path) or (extend_exclude and extend_exclude.match(path)):
                 continue
 
-            path_instance = Path(path)
-            if path_instance.is_file():
+            if isfile(path):
                 good_paths.append(path)
-            elif path_instance.is_dir():
-                for file in path_instance.glob("**/*"):
-                    if file.is_file():
-                        if (
-                            include.search(str(file))
-                            and not exclude.search(str(file))
-                            and not (
-                                extend_exclude and extend_exclude.search(str(file))
-                            )
-                        ):
-                            good_paths.append(str(file))
+            elif isdir(path):
+                from pathlib import Path
+
+                # Normalize the path like Path.glob would do
+                walkers.append(walk(str(Path(path)), include, exclude, extend_exclude))
             else:
                 self.errors.append(f"Cannot open: {path}")
 
-        return sorted(good_paths)
+        yield from merge(sorted(good_paths), *walkers)
+
+    def prettify_args(self, path):
+        """The arguments to pass to the prettify function for path"""
+        config = self.config
+        return (
+            self.choose_prettifier(path),
+            path,
+            config.encoding,
+            config.check,
+            config.inplace,
+        )
+
+    @property
+    def use_cache(self):
+        """The cache is used only when checking or formatting in place"""
+        config = self.config
+        return config.cache and (config.check or config.inplace)
+
+    def get_cache(self, path):
+        """Return the cache for path or None if the cache should not be used"""
+        if path == "-" or not self.use_cache:
+            return None
+        Prettifier = self.choose_prettifier(path)
+        if Prettifier not in self.caches:
+            from zpretty.cache import Cache
+
+            self.caches[Prettifier] = Cache(
+                self.cache_dir, get_version(), Prettifier, self.config.encoding
+            )
+        return self.caches[Prettifier]
+
+    def is_cached(self, path):
+        """Check if the cache knows that path is already prettified"""
+        cache = self.get_cache(path)
+        return bool(cache and cache.is_clean(path))
+
+    def update_cache(self, path, result):
+        """Remember the files that turned out to be already prettified"""
+        cache = self.get_cache(path)
+        if cache and result is True:
+            cache.mark_clean(path)
+
+    def prettify_with_server(self, path):
+        """Prettify path with the zpretty server
+
+        Return the same results of the prettify function.
+        If the server cannot be reached or cannot format the text,
+        the text is prettified in this process
+        (and the server is not asked anymore if it is not reachable
+        or if it runs another version of zpretty).
+        """
+        from zpretty.client import request_format
+        from zpretty.client import ServerError
+        from zpretty.client import VersionError
+        from zpretty.text import first_difference
+
+        config = self.config
+        if path == "-":
+            text = stdin.read()
+        else:
+            with open(path) as f:
+                text = f.read()
+        mode = self.choose_mode(path)
+        try:
+            prettified = request_format(text, mode, config.encoding, config.port)
+        except (OSError, ServerError) as e:
+            if isinstance(e, VersionError) or not isinstance(e, ServerError):
+                self.server_available = False
+            prettified = get_prettifier(mode)(text=text, encoding=config.encoding)()
+            if prettified == text:
+                prettified = None
+
+        if config.check:
+            return prettified is None or first_difference(text, (prettified,))
+        if config.inplace and not path == "-":
+            if prettified is None:
+                return True
+            replace_text(path, (prettified,))
+            return False
+        return text if prettified is None else prettified
+
+    def prettify_path(self, path, stream=False):
+        """Prettify path in this process and update the cache
+
+        With --client, the path is prettified by the zpretty server, if available.
+        With --split, the path is rendered by --jobs processes.
+        """
+        if self.config.client and self.server_available:
+            result = self.prettify_with_server(path)
+        else:
+            jobs = self.config.jobs if self.config.split else 1
+            result = prettify(
+                *self.prettify_args(path),
+                stream=stream,
+                jobs=jobs,
+                repairs=self.repairs,
+            )
+        self.update_cache(path, result)
+        return result
+
+    def iter_results(self, paths, stream=False):
+        """Prettify the paths yielding (path, result) tuples in the same order
+
+        If stream is true, the texts prettified in this process
+        are yielded as iterators of pieces (see ZPrettifier.iter_render).
+
+        Files that the cache knows to be already prettified are skipped.
+
+        With a single job, with --client, with --split or with --low-memory
+        the paths are consumed lazily.
+        Otherwise, if we have more than one file to prettify,
+        the files are distributed across a pool of processes.
+        The largest files are submitted first, so that they do not
+        delay the end of the run.
+        The standard input is always processed in this process.
+        """
+        jobs = max(1, self.config.jobs)
+        config = self.config
+        if jobs == 1 or config.client or config.split or config.low_memory:
+            for path in paths:
+                yield path, self.is_cached(path) or self.prettify_path(path, stream)
+            return
+
+        paths = list(paths)
+        cached = {path for path in paths if self.is_cached(path)}
+        todo = [path for path in paths if path not in cached and path != "-"]
+        if len(todo) < 2:
+            for path in paths:
+                yield path, path in cached or self.prettify_path(path, stream)
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=min(jobs, len(todo))) as executor:
+            futures = {
+                path: executor.submit(prettify_in_worker, *self.prettify_args(path))
+                for path in sorted(todo, key=getsize, reverse=True)
+            }
+            for path in paths:
+                if path in cached:
+                    yield path, True
+                    continue
+                if path == "-":
+                    yield path, self.prettify_path(path, stream)
+                    continue
+                result, self.repairs[path] = futures[path].result()
+                self.update_cache(path, result)
+                yield path, result
+
+    def report_repairs(self):
+        """Report the files where some tags have been repaired
+
+        Those files are broken, e.g. they have some content
+        inside a self closing element like <input>a</input>
+        """
+        for path, repaired_tags in self.repairs.items():
+            if repaired_tags:
+                names = ", ".join(sorted(set(repaired_tags)))
+                stderr.write(
+                    f"Repaired {len(repaired_tags)} tags ({names}) in: {path}\n"
+                )
+
+    def report_cache(self):
+        """Save the caches and report the hits and misses"""
+        caches = self.caches.values()
+        if not caches:
+            return
+        hits = misses = 0
+        for cache in caches:
+            cache.save()
+            hits += cache.hits
+            misses += cache.misses
+        stderr.write(f"Cache hits: {hits}, cache misses: {misses}\n")
 
     def run(self):
-        """Prettify each filename passed in the command line"""
-        encoding = self.config.encoding
-        for path in self.good_paths:
-            # use Pathlib to check if the file exists and it is a file
-            Prettifier = self.choose_prettifier(path)
-            prettifier = Prettifier(path, encoding=encoding)
-            if self.config.check:
-                if not prettifier.check():
-                    self.errors.append(f"This file would be rewritten: {path}")
-                continue
-            prettified = prettifier()
-            if self.config.inplace and not path == "-":
-                with open(path, "w") as f:
-                    f.write(prettified)
+        """Prettify each filename passed in the command line
+
+        With --serve run the zpretty server instead
+        """
+        if self.config.serve:
+            from zpretty.server import serve
+
+            return serve(self.config.port, max(1, self.config.jobs))
+        check = self.config.check
+        for path, result in self.iter_results(self.iter_good_paths(), not check):
+            if check:
+                if result is not True:
+                    line, column = result
+                    self.errors.append(
+                        f"This file would be rewritten: {path} "
+                        f"(first difference at line {line}, column {column})"
+                    )
                 continue
-            stdout.write(prettified)
+            if isinstance(result, str):
+                stdout.write(result)
+            elif not isinstance(result, bool):
+                stdout.writelines(result)
+        self.report_repairs()
+        self.report_cache()
 
         if self.errors:
             message = "\n".join(self.errors)
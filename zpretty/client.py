@@ -0,0 +1,57 @@
+from http.client import HTTPConnection
+from zpretty.cli import DEFAULT_PORT
+from zpretty.cli import get_version
+
+import json
+
+# The zpretty server listens only on localhost
+HOST = "127.0.0.1"
+# How many seconds we wait for the server to accept and answer a request
+TIMEOUT = 10
+
+
+class ServerError(Exception):
+    """The server could not format a text"""
+
+
+class VersionError(ServerError):
+    """The server runs another version of zpretty"""
+
+
+def request_format(text, mode="html", encoding="utf8", port=DEFAULT_PORT):
+    """Ask the server listening on port to format the text
+
+    Return the prettified text, None if the text is already prettified.
+    Raise OSError if the server cannot be reached or does not answer in time,
+    VersionError if it runs another version of zpretty
+    and ServerError if it cannot format the text.
+    """
+    connection = HTTPConnection(HOST, port, timeout=TIMEOUT)
+    try:
+        body = json.dumps({"text": text, "mode": mode, "encoding": encoding})
+        connection.request(
+            "POST", "/", body.encode(), {"Content-Type": "application/json"}
+        )
+        response = connection.getresponse()
+        data = response.read()
+    finally:
+        connection.close()
+    try:
+        reply = json.loads(data)
+    except ValueError:
+        reply = None
+    if not isinstance(reply, dict):
+        raise ServerError(f"Unexpected reply: {data[:100]!r}")
+    if response.status != 200:
+        raise ServerError(str(reply.get("error", f"Status {response.status}")))
+    version = get_version()
+    if reply.get("version") != version:
+        raise VersionError(
+            f"The server runs zpretty {reply.get('version')!r}, not {version!r}"
+        )
+    status = reply.get("status")
+    if status == "unchanged":
+        return None
+    if status == "changed" and isinstance(reply.get("text"), str):
+        return reply["text"]
+    raise ServerError(f"Unexpected reply: {data[:100]!r}")
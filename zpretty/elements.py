@@ -5,10 +5,13 @@ from bs4.element import Doctype
 from bs4.element import NavigableString
 from bs4.element import ProcessingInstruction
 from bs4.element import Tag
+from functools import partial
+from string import Formatter
 from zpretty.attributes import PrettyAttributes
+from zpretty.text import BLANKS
+from zpretty.text import Chunks
 from zpretty.text import endswith_whitespace
-from zpretty.text import lstrip_first_line
-from zpretty.text import rstrip_last_line
+from zpretty.text import has_escapable_characters
 from zpretty.text import startswith_whitespace
 
 
@@ -23,16 +26,61 @@ class OpenTagException(Exception):
         return "Known self closing tag %r is not closed" % self.el.context
 
 
-def memo(f):
-    """Simple memoize"""
-    key = "__zpretty_memo__" + f.__name__
+# The kinds of nodes wrapped by a PrettyElement
+SOUP = "soup"
+NULL = "null"
+TAG = "tag"
+COMMENT = "comment"
+DOCTYPE = "doctype"
+PROCESSING_INSTRUCTION = "processing_instruction"
+TEXT = "text"
+TAG_KINDS = frozenset((SOUP, NULL, TAG))
+
+# Marks the cache slots that are not filled yet
+_missing = object()
+
+# The fields that a tag template can use
+TEMPLATE_FIELDS = frozenset(("prefix", "tag", "attributes", "before_closing_multiline"))
+
+
+def compile_template(template, before_closing_multiline=""):
+    """Compile a tag template in a function that renders it
+
+    The function takes an element and the lead, i.e. the indentation
+    to be used in place of a {prefix} field at the start of the template.
+    The value of the before_closing_multiline field is replaced once and for all,
+    the other fields are taken from the element only if they are used.
+
+    Templates with other fields, conversions or format specs
+    are rendered with str.format.
+    """
+    parts = []
+    for literal, field, format_spec, conversion in Formatter().parse(template):
+        if literal:
+            parts.append(repr(literal))
+        if field is None:
+            continue
+        if format_spec or conversion or field not in TEMPLATE_FIELDS:
+            return partial(_format_template, template, before_closing_multiline)
+        if field == "before_closing_multiline":
+            parts.append(repr(before_closing_multiline))
+        elif field == "prefix" and not parts:
+            parts.append("lead")
+        elif field == "attributes":
+            parts.append("element.attributes.lstrip()")
+        else:
+            parts.append(f"element.{field}")
+    return eval(f"lambda element, lead: {' + '.join(parts) or repr('')}")
 
-    def wrapped(obj):
-        if not hasattr(obj, key):
-            setattr(obj, key, f(obj))
-        return getattr(obj, key)
 
-    return wrapped
+def _format_template(template, before_closing_multiline, element, lead):
+    """Render a template that compile_template cannot handle"""
+    return template.format(
+        before_closing_multiline=before_closing_multiline,
+        attributes=element.attributes.lstrip(),
+        prefix=element.prefix,
+        tag=element.tag,
+    )
 
 
 class PrettyElement:
@@ -91,10 +139,31 @@ class PrettyElement:
         "textarea",
     ]
 
+    __slots__ = (
+        "context",
+        "level",
+        "kind",
+        "tag",
+        "repaired_tags",
+        "_parent",
+        "_children",
+        "_attributes",
+        "_preserve_text_whitespace",
+        "_rendered",
+    )
+
     def __init__(self, context, level=0):
         """Take something a (bs4) element and an indentation level"""
         self.context = context
         self.level = level
+        self.kind = self.get_kind()
+        self.tag = self.get_tag()
+        self.repaired_tags = []
+        self._parent = _missing
+        self._children = None
+        self._attributes = None
+        self._preserve_text_whitespace = None
+        self._rendered = None
 
     def __str__(self):
         """Reuse the context method"""
@@ -106,38 +175,57 @@ class PrettyElement:
         - the element type
         - the level
         """
-        if self.is_comment():
+        if self.kind == COMMENT:
             tag = "!--"
-        if self.is_text():
+        elif self.kind == TEXT:
             tag = '""'
         else:
             tag = self.tag
         return f"<pretty:{self.level}:{tag} />"
 
+    def get_kind(self):
+        """Return the kind of the wrapped node"""
+        context = self.context
+        if isinstance(context, Tag):
+            if isinstance(context, BeautifulSoup):
+                return SOUP
+            if context.name == self.null_tag_name:
+                return NULL
+            return TAG
+        if isinstance(context, Comment):
+            return COMMENT
+        if isinstance(context, Doctype):
+            return DOCTYPE
+        if isinstance(context, ProcessingInstruction):
+            return PROCESSING_INSTRUCTION
+        if isinstance(context, NavigableString):
+            return TEXT
+        return None
+
+    def get_tag(self):
+        """Return the tag name"""
+        return self.context.name
+
     def is_comment(self):
         """Check if this element is a comment"""
-        return isinstance(self.context, Comment)
+        return self.kind == COMMENT
 
     def is_doctype(self):
         """Check if this element is a doctype"""
-        return isinstance(self.context, Doctype)
+        return self.kind == DOCTYPE
 
     def is_text(self):
         """Check if this element is a text
 
         Also comments and processing instructions
         are instances of NavigableString,
-        so we have to make additional checks
+        but they have their own kind
         """
-        if not isinstance(self.context, NavigableString):
-            return False
-        if self.is_comment() or self.is_doctype() or self.is_processing_instruction():
-            return False
-        return True
+        return self.kind == TEXT
 
     def is_tag(self):
         """Check if this element is a notmal tag"""
-        return isinstance(self.context, Tag)
+        return self.kind in TAG_KINDS
 
     def is_self_closing(self):
         """Is this element self closing?"""
@@ -164,46 +252,58 @@ class PrettyElement:
 
     def is_null(self):
         """We define a special tag null_tag_name to wrap text"""
-        return self.context.name == self.null_tag_name
+        return self.kind == NULL
 
     def is_soup(self):
         """Check if this element is a BeautifulSoup instance"""
-        return isinstance(self.context, BeautifulSoup)
+        return self.kind == SOUP
 
     def is_processing_instruction(self):
         """Check if this element is a processing instruction like <?xml...>"""
-        return isinstance(self.context, ProcessingInstruction)
+        return self.kind == PROCESSING_INSTRUCTION
 
-    @memo
     def getparent(self):
         """Return the element parent as an instance of this class"""
-        parent = self.context.parent
-        if not parent or parent.name == BeautifulSoup.ROOT_TAG_NAME:
-            return None
-        return self.__class__(parent)
+        if self._parent is _missing:
+            parent = self.context.parent
+            if not parent or parent.name == BeautifulSoup.ROOT_TAG_NAME:
+                self._parent = None
+            else:
+                self._parent = self.__class__(parent)
+        return self._parent
 
-    @memo
     def getchildren(self):
-        """Return this element children as instances of this class"""
-        children = []
+        """Return this element children as instances of this class
+
+        The content of the known self closing tags is moved after them,
+        the names of the fixed tags are recorded in repaired_tags
+        """
+        if self._children is not None:
+            return self._children
+        children = self._children = []
+        if self.kind not in TAG_KINDS:
+            return children
         next_level = self.level + 1
-        for child in getattr(self.context, "children", []):
-            child = self.__class__(child, next_level)
-            try:
-                child.is_tag() and child.is_self_closing()
-            except OpenTagException:
-                # Fix open tags and repeat
-                nephews = reversed(tuple(child.context.children))
-                for nephew in nephews:
-                    child.context.insert_after(nephew)
-                return self.getchildren()
+        contents = self.context.contents
+        idx = 0
+        while idx < len(contents):
+            child = self.__class__(contents[idx], next_level)
+            child.repaired_tags = self.repaired_tags
+            if child.must_be_closed():
+                # Fix the open tag: its content will be visited next
+                self.context.insert(idx + 1, *tuple(child.context.contents))
+                self.repaired_tags.append(child.tag)
             children.append(child)
+            idx += 1
         return children
 
-    @property
-    def tag(self):
-        """Return the tag name"""
-        return self.context.name
+    def must_be_closed(self):
+        """Check if this is a known self closing tag that has some content"""
+        return (
+            self.kind == TAG
+            and self.tag in self.knownself_closing_elements
+            and bool(self.context.contents)
+        )
 
     @property
     def text(self):
@@ -211,88 +311,81 @@ class PrettyElement:
 
         Convert the text characters to html entities
         """
-        if not isinstance(self.context, NavigableString):
-            return ""
-        if self.is_comment():
+        kind = self.kind
+        if kind == COMMENT:
             return self.context
+        if kind not in (TEXT, DOCTYPE, PROCESSING_INSTRUCTION):
+            return ""
+        string = self.context.string
         if (
             not self.escaper
             or self.context.parent.name in self.skip_text_escaping_elements
         ):
-            return self.context.string
-        return self.escaper.substitute_html(self.context.string)
+            return string
+        if string.isascii() and not has_escapable_characters(string):
+            # Most of the texts do not need to be escaped
+            return string
+        return self.escaper.substitute_html(string)
 
     @property
-    @memo
     def attributes(self):
         """Return the wrapped attributes"""
-        attributes = getattr(self.context, "attrs", {})
-        return self.attribute_klass(attributes, self)
+        if self._attributes is None:
+            attributes = getattr(self.context, "attrs", {})
+            self._attributes = self.attribute_klass(attributes, self)
+        return self._attributes
 
     @property
-    @memo
     def preserve_text_whitespace(self):
-        children = self.getchildren()
-        return (
-            self.tag in self.preserve_text_whitespace_elements
-            and len(children) == 1
-            and children[0].is_text()
-        )
-
-    @memo
-    def render_content(self):
-        """Render a properly indented the contents of this element"""
-        parts = []
-        previous_part = ""
-
-        if self.preserve_text_whitespace:
-            for child in self.getchildren():
-                return child.text
-
-        for idx, child in enumerate(self.getchildren()):
-            part = child()
-            if child.is_text():
-                part = lstrip_first_line(part)
-            elif not endswith_whitespace(previous_part):
-                part = lstrip_first_line(part)
-            else:
-                parts[-1] = rstrip_last_line(parts[-1])
-            parts.append(part)
-            previous_part = child()
-        content = "".join(parts)
-
-        if endswith_whitespace(content):
-            content = rstrip_last_line(content)
-        return content
+        if self._preserve_text_whitespace is None:
+            children = self.getchildren()
+            self._preserve_text_whitespace = (
+                self.tag in self.preserve_text_whitespace_elements
+                and len(children) == 1
+                and children[0].is_text()
+            )
+        return self._preserve_text_whitespace
 
     @property
     def prefix(self):
-        return self.indent * self.level
+        """Return the indentation of this element, cached per level"""
+        try:
+            return self._prefixes[self.level]
+        except KeyError:
+            prefix = self._prefixes[self.level] = self.indent * self.level
+            return prefix
+
+    def render_comment(self, lead=None):
+        """Render a properly indented comment
+
+        lead is used in place of the prefix before the comment
+        """
+        if lead is None:
+            lead = self.prefix
+        return f"{lead}<!--{self.text}-->"
 
-    def render_comment(self):
-        """Render a properly indented comment"""
-        return f"{self.prefix}<!--{self.text}-->"
+    def render_doctype(self, lead=None):
+        """Render a properly indented comment
 
-    def render_doctype(self):
-        """Render a properly indented comment"""
-        doctype = f"{self.prefix}{self.context.PREFIX}{self.text}{self.context.SUFFIX}"
+        lead is used in place of the prefix before the doctype
+        """
+        if lead is None:
+            lead = self.prefix
+        doctype = f"{lead}{self.context.PREFIX}{self.text}{self.context.SUFFIX}"
         if isinstance(
             self.context.next_sibling, NavigableString
         ) and self.context.next_sibling.startswith("\n"):
             doctype = doctype.rstrip()
         return doctype
 
-    def render_processing_instruction(self):
-        """Render a properly indented processing instruction"""
-        return f"{self.prefix}<?{self.text.rstrip('?')}?>"
+    def render_processing_instruction(self, lead=None):
+        """Render a properly indented processing instruction
 
-    def render_soup(self):
-        first_child = next(self.context.children)
-        if isinstance(first_child, Doctype) and not self.context.is_xml:
-            return self.render_content()
-        if isinstance(first_child, ProcessingInstruction):
-            return self.render_content()
-        return f'<?xml version="1.0" encoding="utf-8"?>\n{self.render_content()}'
+        lead is used in place of the prefix before the processing instruction
+        """
+        if lead is None:
+            lead = self.prefix
+        return f"{lead}<?{self.text.rstrip('?')}?>"
 
     def render_text(self):
         """Render a properly indented text
@@ -305,13 +398,12 @@ class PrettyElement:
         if not lines:
             return ""
 
-        prefix = self.prefix
         if len(lines) == 1:
             line = lines[0]
             if not line.strip():
                 return "\n"
             if startswith_whitespace(line):
-                line = f"\n{prefix}{line.lstrip()}"
+                line = f"\n{self.prefix}{line.lstrip()}"
             if endswith_whitespace(line):
                 line = f"{line.rstrip()}\n"
             return line
@@ -319,7 +411,7 @@ class PrettyElement:
         if not lines[0].strip():
             rendered_lines = ["\n"]
         elif startswith_whitespace(lines[0]):
-            rendered_lines = [f"\n{prefix}{lines[0].rstrip()}\n"]
+            rendered_lines = [f"\n{self.prefix}{lines[0].rstrip()}\n"]
         else:
             rendered_lines = [f"{lines[0]}\n"]
 
@@ -334,7 +426,7 @@ class PrettyElement:
                 if lines[-1].lstrip() == lines[-1]:
                     rendered_lines.append(lines[-1])
                 else:
-                    rendered_lines.append(prefix + lines[-1].lstrip())
+                    rendered_lines.append(self.prefix + lines[-1].lstrip())
             else:
                 rendered_lines.append("%s\n" % lines[-1].rstrip())
         else:
@@ -342,15 +434,40 @@ class PrettyElement:
         text = "".join(rendered_lines)
         return text
 
-    def _render_template(self, template):
-        return template.format(
-            before_closing_multiline=self.before_closing_multiline,
-            attributes=self.attributes.lstrip(),
-            prefix=self.prefix,
-            tag=self.tag,
-        )
-
-    def render_self_closing(self):
+    @classmethod
+    def _compile_templates(cls):
+        """Compile the templates of this class and prepare the prefixes cache"""
+        cls._compiled_templates = {}
+        for name in dir(cls):
+            template = getattr(cls, name)
+            if name.endswith("_template") and isinstance(template, str):
+                cls._compiled_templates[template] = compile_template(
+                    template, cls.before_closing_multiline
+                )
+        cls._prefixes = {}
+        # An indentation that can be skipped when it would be stripped anyway
+        cls._blank_indent = not cls.indent.strip(BLANKS)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compile_templates()
+
+    def _render_template(self, template, lead=None):
+        """Render the template with the compiled function
+
+        lead is used in place of a prefix at the start of the template
+        """
+        try:
+            render = self._compiled_templates[template]
+        except KeyError:
+            render = self._compiled_templates[template] = compile_template(
+                template, self.before_closing_multiline
+            )
+        if lead is None:
+            lead = self.prefix
+        return render(self, lead)
+
+    def render_self_closing(self, lead=None):
         """Render a properly indented a self closing tag"""
         attributes_len = len(self.attributes)
         if attributes_len == 0:
@@ -359,10 +476,23 @@ class PrettyElement:
             template = self.self_closing_singleline_attributefull_template
         else:
             template = self.self_closing_multiline_template
-        return self._render_template(template)
+        return self._render_template(template, lead)
+
+    def render_start(self, lead=None):
+        """Render what comes before the content of this element
 
-    def render_not_self_closing(self):
-        """Render a properly indented not self closing tag"""
+        lead is used in place of the prefix before the open tag
+        """
+        kind = self.kind
+        if kind == SOUP:
+            first_child = next(self.context.children)
+            if isinstance(first_child, Doctype) and not self.context.is_xml:
+                return ""
+            if isinstance(first_child, ProcessingInstruction):
+                return ""
+            return '<?xml version="1.0" encoding="utf-8"?>\n'
+        if kind == NULL:
+            return ""
         attributes_len = len(self.attributes)
         if attributes_len == 0:
             open_tag_template = self.start_tag_singleline_attributeless_template
@@ -370,44 +500,199 @@ class PrettyElement:
             open_tag_template = self.start_tag_singleline_attributefull_template
         else:
             open_tag_template = self.start_tag_multiline_template
+        return self._render_template(open_tag_template, lead)
 
-        text = self.text and self.render_text() or self.render_content()
+    def render_end(self, content_end):
+        """Render what comes after the content of this element
 
-        if not self.preserve_text_whitespace and endswith_whitespace(text):
-            if text[-1] != "\n":
-                text = f"{rstrip_last_line(text)}\n"
-            close_tag_template = "{prefix}</{tag}>"
-        else:
-            close_tag_template = "</{tag}>"
+        content_end is the last character of the rendered content
+        """
+        if self.kind != TAG:
+            return ""
+        if not self.preserve_text_whitespace and content_end.isspace():
+            return f"{self.prefix}</{self.tag}>"
+        return f"</{self.tag}>"
+
+    def has_content(self):
+        """Check if the content of this element is rendered child by child"""
+        kind = self.kind
+        if kind not in TAG_KINDS or self.preserve_text_whitespace:
+            return False
+        if kind == TAG:
+            return not self.is_self_closing()
+        return True
 
-        open_tag = self._render_template(open_tag_template)
-        close_tag = self._render_template(close_tag_template)
-        return "{open_tag}{text}{close_tag}".format(
-            close_tag=close_tag, open_tag=open_tag, text=text
-        )
+    def render(self, lead=None):
+        """Render an element that has no content to be rendered child by child
 
-    @memo
-    def __call__(self):
-        """Render the element and its contents properly indented"""
-        if self.is_soup():
-            return self.render_soup()
+        lead is used in place of the prefix at the start of the element
+        """
+        kind = self.kind
+        if kind == COMMENT:
+            return self.render_comment(lead)
 
-        if self.is_null():
-            return self.render_content()
+        if kind in TAG_KINDS:
+            if self.is_self_closing():
+                return self.render_self_closing(lead)
+            # The text is preserved as it is
+            for child in self.getchildren():
+                start = self.render_start(lead)
+                return f"{start}{child.text}{self.render_end('')}"
 
-        if self.is_comment():
-            return self.render_comment()
+        if kind == PROCESSING_INSTRUCTION:
+            return self.render_processing_instruction(lead)
 
-        if self.is_tag():
-            if self.is_self_closing():
-                return self.render_self_closing()
+        if kind == DOCTYPE:
+            return self.render_doctype(lead)
+
+        return self.render_text()
+
+    def lead(self, chunks):
+        """Return the lead to be used when writing this element in chunks
+
+        There is no point in rendering the indentation
+        if the chunks are going to strip it, otherwise use the prefix
+        """
+        if chunks.lstripping and self._blank_indent:
+            return ""
+        return None
+
+    def iter_write(self, chunks, prerendered=None):
+        """Write the element and its contents properly indented in chunks
+
+        chunks is a zpretty.text.Chunks instance.
+        The elements are written using an explicit stack instead of recursion,
+        so that deeply nested documents can be rendered as well.
+
+        prerendered optionally maps some of the descendants
+        to the text they render (see ZPrettifier.prerender):
+        that text is written instead of rendering them again.
+
+        This is a generator that yields after each step,
+        so that the caller can flush the chunks while they are written.
+        """
+        if not self.has_content():
+            chunks.write(self.render())
+            return
+
+        stack = [ContentWriter(self, chunks)]
+        last = None
+        while stack:
+            writer = stack[-1]
+            if last is not None:
+                writer.end_child(last)
+            child = writer.start_child()
+            if child is None:
+                stack.pop()
+                last = writer.close()
+            elif prerendered and child in prerendered:
+                # The text is lstripped, if needed, when written
+                text = prerendered[child]
+                chunks.write(text)
+                last = text[-1:]
+            elif child.has_content():
+                stack.append(ContentWriter(child, chunks))
+                last = None
             else:
-                return self.render_not_self_closing()
+                text = child.render(child.lead(chunks))
+                chunks.write(text)
+                last = text[-1:]
+            yield
 
-        if self.is_processing_instruction():
-            return self.render_processing_instruction()
+    def write(self, chunks, prerendered=None):
+        """Write the element and its contents properly indented in chunks"""
+        for _ in self.iter_write(chunks, prerendered):
+            pass
 
-        if self.is_doctype():
-            return self.render_doctype()
+    def iter_render(self, size=1024, prerendered=None):
+        """Render the element yielding the text in pieces
 
-        return self.render_text()
+        The chunks are flushed when there are at least size of them,
+        so that the whole text is never kept in memory.
+        """
+        if self._rendered is not None:
+            yield self._rendered
+            return
+        chunks = Chunks()
+        limit = size
+        for _ in self.iter_write(chunks, prerendered):
+            if len(chunks) >= limit:
+                text = "".join(chunks.flush())
+                if text:
+                    yield text
+                # Do not flush again and again when only a few chunks are final
+                limit = max(size, 2 * len(chunks))
+        text = "".join(chunks.flush(final=True))
+        if text:
+            yield text
+
+    def __call__(self):
+        """Render the element and its contents properly indented"""
+        if self._rendered is None:
+            chunks = Chunks()
+            self.write(chunks)
+            self._rendered = "".join(chunks)
+        return self._rendered
+
+
+class ContentWriter:
+    """Write an element and the properly indented content of its children
+
+    The children are written one by one in the chunks:
+
+    - the first line of a child is lstripped if the child is a text
+      or if the previous child does not end with a whitespace,
+      otherwise the last line of the previous child is rstripped
+    - the last line of the content is rstripped
+    """
+
+    def __init__(self, element, chunks):
+        self.element = element
+        self.chunks = chunks
+        self.children = iter(element.getchildren())
+        self.start = element.render_start(element.lead(chunks))
+        chunks.write(self.start)
+        self.content_start = chunks.tell()
+        self.child_start = None
+        self.child_lstripped = False
+        self.previous_end = ""
+        self.lstripping = False
+
+    def start_child(self):
+        """Prepare the chunks for the next child and return it
+
+        Return None if there are no more children
+        """
+        child = next(self.children, None)
+        if child is None:
+            return None
+        chunks = self.chunks
+        self.child_lstripped = child.kind == TEXT or not self.previous_end.isspace()
+        if not self.child_lstripped:
+            chunks.rstrip(self.child_start)
+        self.child_start = chunks.tell()
+        self.lstripping = chunks.lstripping
+        if self.child_lstripped:
+            chunks.lstripping = True
+        return child
+
+    def end_child(self, last):
+        """Take note that the last child ended with the last character"""
+        chunks = self.chunks
+        if self.child_lstripped and last.isspace():
+            # lstrip_first_line adds a space to a text ending with a whitespace
+            chunks.write(" ")
+        chunks.lstripping = chunks.lstripping and self.lstripping
+        self.previous_end = last
+
+    def close(self):
+        """Write the end of the element and return its last character"""
+        chunks = self.chunks
+        chunks.rstrip(self.content_start)
+        content_end = chunks.last(self.content_start)
+        end = self.element.render_end(content_end)
+        chunks.write(end)
+        return end[-1:] or content_end or self.start[-1:]
+
+
+PrettyElement._compile_templates()
@@ -0,0 +1,76 @@
+# This module is imported by the zpretty package and by the command line,
+# so the prettifiers (and with them bs4 and lxml) are imported only when needed.
+
+MODES = ("html", "xml", "zcml")
+
+
+def get_prettifier(mode):
+    """Return the prettifier class for mode (html, xml or zcml)"""
+    if mode == "zcml":
+        from zpretty.zcml import ZCMLPrettifier
+
+        return ZCMLPrettifier
+    if mode == "xml":
+        from zpretty.xml import XMLPrettifier
+
+        return XMLPrettifier
+    if mode == "html":
+        from zpretty.prettifier import ZPrettifier
+
+        return ZPrettifier
+    raise ValueError(f"Unknown mode: {mode!r}")
+
+
+class Formatter:
+    """Format texts in one of the zpretty modes (html, xml or zcml)
+
+    A formatter keeps no state about the texts it formats:
+    every text gets its own prettifier instance,
+    so the same formatter can be used by many threads at once.
+
+    With jobs > 1 a huge text is rendered by forked processes (see --split),
+    but only on Linux and when the formatter is used by the only thread
+    of the process: otherwise it is rendered by the calling thread.
+    """
+
+    def __init__(self, mode="html", encoding="utf8", jobs=1):
+        self.mode = mode
+        self.encoding = encoding
+        self.jobs = jobs
+        self.prettifier = get_prettifier(mode)
+
+    def __repr__(self):
+        return f"<Formatter mode={self.mode!r} encoding={self.encoding!r}>"
+
+    def new_prettifier(self, text):
+        """Return a prettifier instance for text"""
+        return self.prettifier(text=text, encoding=self.encoding, jobs=self.jobs)
+
+    def format(self, text):
+        """Return the prettified text"""
+        return self.new_prettifier(text)()
+
+    def iter_format(self, text):
+        """Yield the prettified text in pieces"""
+        return self.new_prettifier(text).iter_render()
+
+    def first_difference(self, text):
+        """Return the line and the column where the prettified text
+        differs for the first time from text, None if text is already prettified
+        """
+        return self.new_prettifier(text).first_difference()
+
+    def check(self, text):
+        """Check if text is already prettified"""
+        return self.first_difference(text) is None
+
+
+def format_text(text, mode="html", options=None):
+    """Return the text prettified in the given mode (html, xml or zcml)
+
+    options is a mapping with the other arguments accepted by Formatter
+    (e.g. the encoding used to decode the text, if it is bytes,
+    or the number of processes used to render it).
+    It is safe to call this function from many threads at once.
+    """
+    return Formatter(mode, **(options or {})).format(text)
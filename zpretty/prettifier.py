@@ -1,190 +1,419 @@
 from bs4 import BeautifulSoup
+from bs4.builder import HTMLParserTreeBuilder
+from bs4.builder import ParserRejectedMarkup
+from bs4.builder._htmlparser import BeautifulSoupHTMLParser
 from bs4.element import Doctype
 from bs4.element import ProcessingInstruction
-from bs4.element import Tag
+from functools import partial
 from logging import getLogger
-from uuid import uuid4
+from os import urandom
+from sys import platform
+from sys import stdin
 from zpretty.elements import PrettyElement
+from zpretty.elements import TAG
+from zpretty.text import first_difference
 
-import fileinput
+import gc
 import re
 
 logger = getLogger(__name__)
 
+# The element whose children are rendered by a worker process, see prerender
+_shard_parent = None
+
+
+def new_marker():
+    """Return a random hexadecimal string to be used as a marker
+
+    We do not need a real UUID and the uuid module is slow to import
+    """
+    return urandom(16).hex()
+
+
+def _set_shard_parent(element):
+    """Set the element whose children are rendered by this worker process"""
+    global _shard_parent
+    _shard_parent = element
+
+
+def _render_children(indexes):
+    """Render the children of the shard parent with the given indexes
+
+    This runs in a worker process forked by ZPrettifier.prerender
+    """
+    children = _shard_parent.getchildren()
+    return [children[idx]() for idx in indexes]
+
+
+class ZHTMLParser(BeautifulSoupHTMLParser):
+    """Parse the content of the RCDATA tags as markup
+
+    Page templates can contain markup inside RCDATA tags,
+    e.g. inside a <title> or <textarea>,
+    and we want to prettify it as well,
+    see https://github.com/collective/zpretty/issues/198
+    """
+
+    RCDATA_CONTENT_ELEMENTS = ()
+
+    def handle_endtag(self, tag, check_already_closed=True):
+        """Record the end tags of the self closing elements that we drop
+
+        They are what is left of a self closing element with some content,
+        e.g. <input>a</input>, whose content has been moved after it
+        """
+        if check_already_closed and tag in self.already_closed_empty_element:
+            if self.soup.currentTag.name == tag:
+                # This ends a <tag/> that follows a <tag>:
+                # BeautifulSoupHTMLParser would leave it open
+                return self.soup.handle_endtag(tag)
+            self.soup.prettifier.repaired_tags.append(tag)
+        super().handle_endtag(tag, check_already_closed)
+
+
+class ZHTMLParserTreeBuilder(HTMLParserTreeBuilder):
+    """A tree builder that uses our ZHTMLParser"""
+
+    def feed(self, markup):
+        args, kwargs = self.parser_args
+        parser = ZHTMLParser(self.soup, *args, **kwargs)
+        try:
+            parser.feed(markup)
+            parser.close()
+        except AssertionError as e:
+            # See HTMLParserTreeBuilder.feed
+            raise ParserRejectedMarkup(e)
+        parser.already_closed_empty_element = []
+
+
+class ZSoup(BeautifulSoup):
+    """A BeautifulSoup that lets the prettifier fix the tags while they are built"""
+
+    def __init__(self, markup, features, prettifier, **kwargs):
+        self.prettifier = prettifier
+        super().__init__(markup, features, **kwargs)
+
+    def handle_starttag(self, *args, **kwargs):
+        tag = super().handle_starttag(*args, **kwargs)
+        if tag is not None:
+            self.prettifier.fix_tag(tag)
+        return tag
+
 
 class ZPrettifier:
     """Wraps and renders some text that may contain xml like stuff"""
 
     pretty_element = PrettyElement
     parser = "html.parser"
-    builder = None
+    builder = ZHTMLParserTreeBuilder
     _end_with_newline = True
-    _newlines_marker = f"new-line-{str(uuid4())}"
-    _ampersand_marker = str(uuid4())
-    _cdata_marker = str(uuid4())
-    _cdata_pattern = re.compile(r"<!\[CDATA\[(.*?)\]\]>", re.DOTALL)
-    _doctype_marker = f"<!DOCTYPE foo-{str(uuid4())}>"
-    _doctype_pattern = re.compile(
-        r"(<!DOCTYPE[^>[]*(\[[^]]*\])?>)", re.IGNORECASE | re.DOTALL
+    _newlines_marker = f"new-line-{new_marker()}"
+    _ampersand_marker = new_marker()
+    _cdata_marker = new_marker()
+    _doctype_marker = f"<!DOCTYPE foo-{new_marker()}>"
+    _entity_marker = new_marker()
+    # Match in one go all the things that _prepare_text has to replace
+    _prepare_pattern = re.compile(
+        "|".join(
+            (
+                r"(?P<cdata><!\[CDATA\[(?P<cdata_content>.*?)\]\]>)",
+                r"(?P<doctype>(?i:<!DOCTYPE[^>[]*(?:\[[^]]*\])?>))",
+                r"(?P<entity>(?i:&(?:[a-z0-9]+|#[0-9]{1,6}|#x[0-9a-fA-F]{1,6});))",
+                r"(?P<ampersand>&)",
+            )
+        ),
+        re.DOTALL,
+    )
+    # Match in one go all the markers that pretty_print has to restore
+    _restore_pattern = re.compile(
+        "|".join(
+            (
+                f"(?P<newline>{_newlines_marker})",
+                f"(?P<ampersand>{_ampersand_marker})",
+                f"(?P<cdata>{_cdata_marker})",
+                f"(?P<doctype>{re.escape(_doctype_marker)})",
+                f"(?P<entity>{_entity_marker}[0-9]+-)",
+            )
+        )
     )
-    _rcdata_tags = ("title", "textarea")
-    _cdatas = []
-    _doctype = None
 
-    def __init__(self, filename="", text="", encoding="utf8"):
+    def __init__(self, filename="", text="", encoding="utf8", jobs=1):
         """Create a prettifier instance taking the contents
-        from a text or a filename
+        from a text or a filename ("-" means the standard input)
+
+        All the state about the document is kept in the instance,
+        so different instances can be used by different threads at once.
+
+        If jobs is greater than 1, the biggest elements of the document
+        are rendered in parallel by that many processes (see prerender).
+
+        The names of the tags repaired while parsing and rendering
+        are recorded in repaired_tags (see PrettyElement.getchildren).
         """
+        self.jobs = jobs
+        self.repaired_tags = []
+        self._cdatas = []
+        self._doctype = None
         self._entity_mapping = {}
+        self._entity_markers = {}
         self.encoding = encoding
         self.filename = filename
         if self.filename:
-            text = "".join(fileinput.input([filename]))
+            text = self.read(filename)
         if not isinstance(text, str):
             text = text.decode(self.encoding)
         self.original_text = text
         self.text = self._prepare_text()
-        soup = self.get_soup(self.text)
-        # Workaround for https://github.com/collective/zpretty/issues/116
-        # restore the ampersands
-        # in the attributes so that bogus ones can be escaped
-        for el in soup.descendants:
-            attrs = getattr(el, "attrs", {})
-            for key, value in attrs.items():
-                if self._ampersand_marker in value:
-                    attrs[key] = value.replace(self._ampersand_marker, "&")
-
-        if self.parser == "html.parser":
-            # Page templates are parsed with the html.parser,
-            # but can contain invalid markup inside RCDATA tags,
-            # see https://github.com/collective/zpretty/issues/198
-            self.fix_rcdata_markup(soup)
-
-        self.soup = soup
-
-        # Cleanup all spurious self._newlines_marker attributes, see #35
-        key = self._newlines_marker.partition("=")[0]
-        for el in self.soup.find_all(attrs={key: ""}):
-            el.attrs.pop(key, None)
-
+        self.soup = self.get_soup(self.text)
         self.root = self.pretty_element(self.soup, -1)
+        self.root.repaired_tags = self.repaired_tags
 
-    def fix_rcdata_markup(self, soup):
-        """Parse markup-like text inside RCDATA tags as child nodes.
-
-        In page templates we might have elements inside these fields,
-        e.g. inside a <title> or <textarea>.
-        The html.parser used by BeautifulSoup escapes the markup inside these tags
-        and does not parse it as tags, but we want to prettify it as well.
-
-        This method applies a workaround for this problem,
-        by prettifying the content of these tags as if it were an XML fragment
-        and then replacing the content of the tag with the prettified version.
+    def read(self, filename):
+        """Return the content of filename"""
+        if filename == "-":
+            return stdin.read()
+        with open(filename) as f:
+            return f.read()
 
-        Then the rcdata elements content will be rendered as it is.
-        """
-        for tag in soup.find_all(self._rcdata_tags):
-            raw_content = "".join(str(node) for node in tag.contents)
+    def parse(self, markup, **kwargs):
+        """Parse the markup fixing the tags while they are built"""
+        if self.builder is not None:
+            kwargs.setdefault("builder", self.builder())
+        return ZSoup(markup, self.parser, self, **kwargs)
 
-            null_tag_name = self.pretty_element.null_tag_name
-            fragment_soup = BeautifulSoup(
-                f"<{null_tag_name}>{raw_content}</{null_tag_name}>",
-                self.parser,
-            )
-            fragment_root = getattr(fragment_soup, null_tag_name, None)
-            if not fragment_root:
-                continue
+    def fix_tag(self, tag):
+        """Fix a tag as soon as the parser creates it"""
+        attrs = tag.attrs
+        if attrs:
+            # Workaround for https://github.com/collective/zpretty/issues/116
+            # restore the ampersands
+            # in the attributes so that bogus ones can be escaped
+            for key, value in attrs.items():
+                if self._ampersand_marker in value:
+                    attrs[key] = value.replace(self._ampersand_marker, "&")
+            # Cleanup all spurious self._newlines_marker attributes, see #35
+            if attrs.get(self._newlines_marker) == "":
+                del attrs[self._newlines_marker]
 
-            parsed_children = list(fragment_root.children)
-            # Check if the tag contains some markup like text,
-            # if not we can skip it and avoid to mess with the content
-            if not any(isinstance(child, Tag) for child in parsed_children):
-                continue
+    def _prepare_match(self, match):
+        """Return the replacement of a match of _prepare_pattern
 
-            # Replace the content of the tag with the parsed prettified children
-            tag.clear()
-            for child in parsed_children:
-                tag.append(child)
+        CDATAs, doctypes and entities are recorded to be restored later
+        (see restorer), the other ampersands are replaced with a marker.
+        """
+        kind = match.lastgroup
+        if kind == "ampersand":
+            return self._ampersand_marker
+        if kind == "entity":
+            # The text might contain undefined entities that BeautifulSoup
+            # will strip out.
+            entity = match.group()
+            try:
+                return self._entity_mapping[entity]
+            except KeyError:
+                marker = f"{self._entity_marker}{len(self._entity_mapping)}-"
+                self._entity_mapping[entity] = marker
+                self._entity_markers[marker] = entity
+                return marker
+        if kind == "cdata":
+            self._cdatas.append(match.group("cdata_content"))
+            return self._cdata_marker
+        if self._doctype is None:
+            self._doctype = match.group()
+        return self._doctype_marker
 
     def _prepare_text(self):
         """This tweaks the text passed to the prettifier
         to overcome some limitations of the BeautifulSoup parser
         that wants to strip what he does not understand
         (e.g. CDATAs or funny entities).
+
+        The text is scanned only once: CDATAs, doctypes and entities
+        are replaced with markers and recorded to be restored later,
+        the remaining ampersands are replaced with a marker as well.
+        Then the blank lines are replaced with a marker
+        to prevent BeautifulSoup from stripping them.
         """
-        text = self.original_text
-        self._cdatas = re.findall(self._cdata_pattern, text)
-        try:
-            self._doctype = self._doctype_pattern.search(text).group(0)
-        except AttributeError:
-            # No match
-            pass
-        text = re.sub(self._cdata_pattern, self._cdata_marker, text)
-        text = re.sub(self._doctype_pattern, self._doctype_marker, text)
-
-        # Get all the entities in the text and replace them with a marker
-        # The text might contain undefined entities that BeautifulSoup
-        # will strip out.
-        entities = {
-            _[0]
-            for _ in re.findall(
-                r"(&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-fA-F]{1,6});)", text, re.IGNORECASE
-            )
-        }
-        for entity in entities:
-            marker = str(uuid4())
-            self._entity_mapping[entity] = marker
-            text = text.replace(entity, marker)
+        text = self._prepare_pattern.sub(self._prepare_match, self.original_text)
         return "\n".join(
             line if line.strip() else self._newlines_marker
             for line in text.splitlines()
-        ).replace("&", self._ampersand_marker)
+        )
 
     def get_soup(self, text):
         """Tries to get the soup from the given test
 
         If the text is not some xml like think a dummy element will be used to wrap it.
+
+        Only a text starting with a doctype or a processing instruction
+        is not wrapped: we can tell that by looking at its first characters,
+        so that the text is usually parsed only once.
         """
-        original_soup = BeautifulSoup(text, self.parser)
-        try:
-            first_el = next(original_soup.children)
-        except StopIteration:
-            first_el = None
-        if isinstance(first_el, (Doctype, ProcessingInstruction)):
-            return original_soup
+        if text.startswith("<?") or text[:9].lower() == "<!doctype":
+            original_soup = self.parse(text)
+            first_el = next(original_soup.children, None)
+            if isinstance(first_el, (Doctype, ProcessingInstruction)):
+                return original_soup
 
         markup = "<{null}>{text}</{null}>".format(
             null=self.pretty_element.null_tag_name, text=text
         )
-        wrapped_soup = BeautifulSoup(markup, self.parser)
+        wrapped_soup = self.parse(markup)
         return getattr(wrapped_soup, self.pretty_element.null_tag_name)
 
+    def restorer(self):
+        """Return a function that restores the markers added by _prepare_text
+
+        The function can be called on consecutive pieces of the rendered text
+        """
+        cdatas = iter(self._cdatas)
+        doctype = self._doctype
+        entities = self._entity_markers
+
+        def restore(match):
+            kind = match.lastgroup
+            if kind == "newline":
+                return ""
+            if kind == "ampersand":
+                return "&"
+            if kind == "entity":
+                return entities.get(match.group(), match.group())
+            if kind == "cdata":
+                for cdata in cdatas:
+                    return f"<![CDATA[{cdata}]]>"
+            elif doctype:
+                return doctype
+            return match.group()
+
+        return partial(self._restore_pattern.sub, restore)
+
     def pretty_print(self, el):
-        """Pretty print an element indenting it based on level"""
-        prettified = (
-            el().replace(self._newlines_marker, "").replace(self._ampersand_marker, "&")
-        )
-        # Restore CDATAs
-        for cdata in self._cdatas:
-            prettified = prettified.replace(
-                self._cdata_marker, f"<![CDATA[{cdata}]]>", 1
-            )
-        # Restore DocTypes
-        if self._doctype:
-            prettified = prettified.replace(self._doctype_marker, self._doctype)
-        # Restore entities
-        for entity, marker in self._entity_mapping.items():
-            prettified = prettified.replace(marker, entity)
+        """Pretty print an element indenting it based on level
+
+        All the markers added by _prepare_text are restored in a single pass
+        """
+        prettified = self.restorer()(el())
         if self._end_with_newline and not prettified.endswith("\n"):
             prettified += "\n"
         return prettified
 
+    def iter_render(self, size=1024):
+        """Yield the prettified text in pieces
+
+        The markers are restored piece by piece:
+        joining the pieces gives the same text returned by calling the prettifier.
+        See PrettyElement.iter_render for the meaning of size.
+        """
+        if not self.root.getchildren():
+            if self.original_text:
+                yield self.original_text
+            return
+        restore = self.restorer()
+        last = ""
+        for piece in self.root.iter_render(size, self.prerender()):
+            piece = restore(piece)
+            if piece:
+                last = piece
+                yield piece
+        if self._end_with_newline and not last.endswith("\n"):
+            yield "\n"
+
+    def get_shard_parent(self):
+        """Return the element whose children can be rendered in parallel
+
+        Starting from the root, we look for the first element
+        with more than one child that has some content
+        (e.g. the document element of an XML file)
+        """
+        element = self.root
+        while True:
+            children = [child for child in element.getchildren() if child.has_content()]
+            if len(children) != 1:
+                return element
+            element = children[0]
+
+    def prerender(self):
+        """Render the children of the shard parent in parallel
+
+        Each child is rendered on its own by a pool of self.jobs processes:
+        its text depends only on its subtree and on its level
+        and it is written in place of the child when rendering the document,
+        so that the result is the same of the serial rendering.
+
+        The worker processes are forked, so that they can access the tree
+        without pickling it: forking is safe only on Linux,
+        so elsewhere, or if there are less than two children to render,
+        nothing is done.
+        Forking and freezing the garbage collector affect the whole process,
+        so nothing is done as well when other threads are running
+        (they could race with us or leave their locks held in the workers).
+
+        Return a dict that maps the rendered children to their text
+        """
+        if self.jobs < 2:
+            return {}
+        if not platform.startswith("linux"):
+            # Fork is not available on Windows and not safe on macOS
+            return {}
+        from threading import active_count
+        from threading import current_thread
+        from threading import main_thread
+
+        if active_count() > 1 or current_thread() is not main_thread():
+            return {}
+        parent = self.get_shard_parent()
+        children = parent.getchildren()
+        indexes = [
+            idx
+            for idx, child in enumerate(children)
+            if child.kind == TAG and child.has_content()
+        ]
+        if len(indexes) < 2:
+            return {}
+
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context
+
+        # Send a few batches of children to each worker to balance the load
+        size = -(-len(indexes) // (self.jobs * 4))
+        batches = [indexes[idx : idx + size] for idx in range(0, len(indexes), size)]
+        # Keep the garbage collector of the workers away from the tree,
+        # otherwise it would touch (and copy) all the memory they share with us
+        gc.freeze()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=min(self.jobs, len(batches)),
+                mp_context=get_context("fork"),
+                initializer=_set_shard_parent,
+                initargs=(parent,),
+            ) as executor:
+                results = executor.map(_render_children, batches)
+                return {
+                    children[idx]: text
+                    for batch, texts in zip(batches, results)
+                    for idx, text in zip(batch, texts)
+                }
+        finally:
+            gc.unfreeze()
+
+    def first_difference(self):
+        """Return the line and the column where the prettified text
+        differs for the first time from the original one,
+        None if the original text is already prettified
+
+        The rendering stops as soon as a difference is found.
+        Lines and columns are counted from 1.
+        """
+        return first_difference(self.original_text, self.iter_render())
+
     def check(self):
         """Checks if the input object should be prettified"""
-        return self.original_text == self()
+        return self.first_difference() is None
 
     def __call__(self):
         if not self.root.getchildren():
             # The parsed content is not even something that looks like an XML
             return self.original_text
+        if self.jobs > 1:
+            return "".join(self.iter_render())
         return self.pretty_print(self.root)
@@ -0,0 +1,180 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from logging import getLogger
+from multiprocessing import get_all_start_methods
+from multiprocessing import get_context
+from signal import signal
+from signal import SIGTERM
+from sys import stderr
+from threading import Lock
+from zpretty.cli import DEFAULT_PORT
+from zpretty.cli import get_version
+from zpretty.client import HOST
+from zpretty.formatter import get_prettifier
+from zpretty.formatter import MODES
+
+import json
+
+logger = getLogger(__name__)
+
+
+def format_text(text, mode="html", encoding="utf8"):
+    """Return the prettified text, None if the text is already prettified
+
+    This is a module level function so that it can be run in a worker process.
+    """
+    prettified = get_prettifier(mode)(text=text, encoding=encoding)()
+    if prettified == text:
+        return None
+    return prettified
+
+
+class FormatHandler(BaseHTTPRequestHandler):
+    """Handle the requests to format a text
+
+    The clients POST a JSON object with the keys:
+
+    - text: the text to format
+    - mode: one of html, xml or zcml (defaults to html)
+    - encoding: the encoding of the text (defaults to utf8)
+
+    The server replies with a JSON object:
+
+    - {"status": "unchanged"} if the text is already prettified
+    - {"status": "changed", "text": "..."} otherwise
+    - {"error": "..."} with status 400 or 500 if the text could not be formatted,
+      503 if the worker process formatting it died
+
+    The replies carry the zpretty version in their version key,
+    so that the clients can tell if the server formats the texts like they do.
+
+    The requests that are not JSON are rejected (status 415),
+    so that a web page cannot make a browser send us a simple cross origin POST,
+    and so are the ones bigger than max_length bytes (status 413).
+    """
+
+    server_version = f"zpretty/{get_version()}"
+    max_length = 2**28
+
+    def log_message(self, format, *args):
+        """Log the requests with the module logger instead of printing them"""
+        logger.info("%s - %s", self.address_string(), format % args)
+
+    def reply(self, code, data):
+        """Send data encoded as JSON, adding the zpretty version"""
+        body = json.dumps(dict(data, version=get_version())).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.headers.get_content_type() != "application/json":
+            self.close_connection = True
+            return self.reply(415, {"error": "The request must be JSON"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError as e:
+            self.close_connection = True
+            return self.reply(400, {"error": f"Bad request: {e}"})
+        if not 0 <= length <= self.max_length:
+            self.close_connection = True
+            return self.reply(
+                413, {"error": f"The request must be at most {self.max_length} bytes"}
+            )
+        try:
+            request = json.loads(self.rfile.read(length))
+            text = request["text"]
+            mode = request.get("mode", "html")
+            encoding = request.get("encoding", "utf8")
+            if not isinstance(text, str):
+                raise ValueError("The text must be a string")
+            if mode not in MODES:
+                raise ValueError(f"Unknown mode: {mode!r}")
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return self.reply(400, {"error": f"Bad request: {e}"})
+
+        try:
+            prettified = self.server.format(text, mode, encoding)
+        except BrokenProcessPool as e:
+            logger.exception("A worker process died")
+            return self.reply(503, {"error": f"{type(e).__name__}: {e}"})
+        except Exception as e:
+            logger.exception("Cannot format the text")
+            return self.reply(500, {"error": f"{type(e).__name__}: {e}"})
+        if prettified is None:
+            return self.reply(200, {"status": "unchanged"})
+        return self.reply(200, {"status": "changed", "text": prettified})
+
+
+class FormatServer(ThreadingHTTPServer):
+    """A server that formats the texts in a pool of worker processes
+
+    Every connection is handled in its own thread,
+    while the texts are formatted by the workers
+    so that the requests are served concurrently.
+    """
+
+    # How the worker processes are started, if the platform supports it:
+    # forking a process that is running many threads is not safe
+    start_method = "forkserver"
+
+    def __init__(self, port=DEFAULT_PORT, jobs=None):
+        super().__init__((HOST, port), FormatHandler)
+        self.jobs = jobs
+        self.lock = Lock()
+        self.executor = self.get_executor()
+
+    def get_executor(self):
+        """Return a new pool of worker processes, with the workers already started
+
+        The workers do not get the socket, because it is not inheritable,
+        so they do not keep it open if the server dies.
+        """
+        if self.start_method in get_all_start_methods():
+            context = get_context(self.start_method)
+        else:
+            context = get_context()
+        executor = ProcessPoolExecutor(max_workers=self.jobs, mp_context=context)
+        executor.submit(format_text, "").result()
+        return executor
+
+    def format(self, text, mode="html", encoding="utf8"):
+        """Format the text in a worker process, see format_text
+
+        If a worker died (e.g. because it was killed when it was out of memory)
+        the pool is broken: it is replaced with a new one
+        and BrokenProcessPool is raised.
+        """
+        executor = self.executor
+        try:
+            return executor.submit(format_text, text, mode, encoding).result()
+        except BrokenProcessPool:
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = self.get_executor()
+                    executor.shutdown(wait=False)
+            raise
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
+
+
+def interrupt(signum, frame):
+    """Stop the server like when it is interrupted with Ctrl+C"""
+    raise KeyboardInterrupt
+
+
+def serve(port=DEFAULT_PORT, jobs=None):
+    """Run the server until it is interrupted or terminated"""
+    signal(SIGTERM, interrupt)
+    with FormatServer(port, jobs) as server:
+        stderr.write(f"zpretty is listening on http://{HOST}:{server.server_port}\n")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
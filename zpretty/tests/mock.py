@@ -1,7 +1,16 @@
+from tempfile import TemporaryDirectory
 from zpretty.cli import CLIRunner
 
 
 class MockCLIRunner(CLIRunner):
     def __init__(self, *args):
         self.errors = []
+        self.caches = {}
+        self.repairs = {}
         self.config = self.parser.parse_args(args)
+        # Do not pollute the user cache while testing
+        self._cache_dir = TemporaryDirectory()
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir.name
@@ -1,4 +1,5 @@
 from bs4 import BeautifulSoup
+from unittest import mock
 from unittest import TestCase
 from zpretty.attributes import PrettyAttributes
 from zpretty.elements import PrettyElement
@@ -77,3 +78,61 @@ class TestZPrettyAttributess(TestCase):
                 )
             ),
         )
+
+    def test_attributes_rendered_once(self):
+        el = self.get_element('<root a="1" b="2"><tal:x c="3" /> <p d="4"></p></root>')
+        with mock.patch.object(
+            PrettyAttributes, "lines", autospec=True, side_effect=PrettyAttributes.lines
+        ) as lines:
+            rendered = el()
+            el.attributes()
+            el.attributes.lstrip()
+        self.assertEqual(
+            rendered,
+            '<root a="1"\n      b="2"\n><tal:x c="3" />\n  <p d="4"></p></root>',
+        )
+        self.assertEqual(lines.call_count, 3)
+
+    def test_sort_attributes(self):
+        attributes = PrettyAttributes({})
+        names = [
+            "i18n:translate",
+            "tal:attributes",
+            "define",
+            "tal:condition",
+            "data-x",
+            "href",
+            "id",
+            "xmlns:tal",
+            "replace",
+        ]
+        self.assertListEqual(
+            sorted(names, key=attributes.sort_attributes),
+            [
+                "xmlns:tal",
+                "id",
+                "href",
+                "data-x",
+                "define",
+                "tal:condition",
+                "replace",
+                "tal:attributes",
+                "i18n:translate",
+            ],
+        )
+
+    def test_sort_attributes_subclass(self):
+        class CustomAttributes(PrettyAttributes):
+            _tal_attribute_order = ("tal:replace", "tal:define")
+            _sort_keys_max_size = 2
+
+        attributes = CustomAttributes({})
+        self.assertEqual(attributes.sort_attributes("define"), (401, "define"))
+        self.assertEqual(attributes.sort_attributes("replace"), (400, "replace"))
+        self.assertEqual(attributes.sort_attributes("custom"), (200, "custom"))
+        # The cache is bounded and it is not shared with the base class
+        self.assertLessEqual(len(CustomAttributes._sort_keys), 2)
+        self.assertNotIn("custom", PrettyAttributes._sort_keys)
+        self.assertEqual(
+            PrettyAttributes({}).sort_attributes("define"), (400, "define")
+        )
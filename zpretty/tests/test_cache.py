@@ -0,0 +1,162 @@
+from tempfile import TemporaryDirectory
+from unittest import mock
+from unittest import TestCase
+from zpretty.cache import Cache
+from zpretty.cache import get_cache_dir
+from zpretty.prettifier import ZPrettifier
+from zpretty.tests.mock import MockCLIRunner
+from zpretty.xml import XMLPrettifier
+
+import os
+
+
+class TestCache(TestCase):
+    """Test the cache of the already prettified files"""
+
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+        self.tmpdir = self._tmpdir.name
+        self.cache_dir = os.path.join(self.tmpdir, "cache")
+        self.path = os.path.join(self.tmpdir, "foo.html")
+        with open(self.path, "w") as f:
+            f.write("<div></div>\n")
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def get_cache(self, Prettifier=ZPrettifier, version="1.0"):
+        return Cache(self.cache_dir, version, Prettifier, "utf8")
+
+    def test_get_cache_dir(self):
+        with mock.patch.dict(os.environ, {"ZPRETTY_CACHE_DIR": self.tmpdir}):
+            self.assertEqual(str(get_cache_dir()), self.tmpdir)
+        with mock.patch.dict(
+            os.environ, {"ZPRETTY_CACHE_DIR": "", "XDG_CACHE_HOME": self.tmpdir}
+        ):
+            self.assertEqual(str(get_cache_dir()), os.path.join(self.tmpdir, "zpretty"))
+
+    def test_cache_roundtrip(self):
+        cache = self.get_cache()
+        self.assertFalse(cache.is_clean(self.path))
+        cache.mark_clean(self.path)
+        self.assertTrue(cache.is_clean(self.path))
+        cache.save()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache = self.get_cache()
+        self.assertTrue(cache.is_clean(self.path))
+        # The key changes with the version and the prettifier
+        self.assertFalse(self.get_cache(version="2.0").is_clean(self.path))
+        self.assertFalse(self.get_cache(XMLPrettifier).is_clean(self.path))
+
+    def test_cache_changed_file(self):
+        cache = self.get_cache()
+        cache.mark_clean(self.path)
+        with open(self.path, "w") as f:
+            f.write("<div> </div>\n")
+        self.assertFalse(cache.is_clean(self.path))
+
+    def test_cache_touched_file(self):
+        """If only the modification time changes, the content hash is checked"""
+        cache = self.get_cache()
+        cache.mark_clean(self.path)
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertTrue(cache.is_clean(self.path))
+        self.assertTrue(cache.changed)
+
+    def test_cache_missing_file(self):
+        cache = self.get_cache()
+        cache.mark_clean(self.path)
+        os.remove(self.path)
+        self.assertFalse(cache.is_clean(self.path))
+
+    def test_prune(self):
+        """Only the files marked clean most recently are kept"""
+        paths = []
+        for idx in range(4):
+            path = os.path.join(self.tmpdir, f"{idx}.html")
+            with open(path, "w") as f:
+                f.write("<div></div>\n")
+            paths.append(path)
+        cache = self.get_cache()
+        cache.max_entries = 2
+        for path in paths:
+            cache.mark_clean(path)
+        cache.mark_clean(paths[0])
+        cache.save()
+        self.assertListEqual(list(self.get_cache().entries), [paths[3], paths[0]])
+
+    def test_concurrent_runs(self):
+        """The entries saved by another run in the meantime are kept"""
+        other_path = os.path.join(self.tmpdir, "bar.html")
+        with open(other_path, "w") as f:
+            f.write("<div></div>\n")
+        cache = self.get_cache()
+        other_cache = self.get_cache()
+        cache.mark_clean(self.path)
+        other_cache.mark_clean(other_path)
+        other_cache.save()
+        cache.save()
+        self.assertListEqual(
+            list(self.get_cache().entries),
+            [os.path.abspath(other_path), os.path.abspath(self.path)],
+        )
+        self.assertFalse(cache.changed)
+        self.assertDictEqual(cache.updates, {})
+
+    def test_broken_cache_file(self):
+        os.makedirs(self.cache_dir)
+        cache = self.get_cache()
+        with open(cache.path, "w") as f:
+            f.write("[")
+        self.assertDictEqual(self.get_cache().entries, {})
+        with open(cache.path, "w") as f:
+            f.write("[]")
+        self.assertDictEqual(self.get_cache().entries, {})
+
+    def test_unwritable_cache_dir(self):
+        with open(self.cache_dir, "w"):
+            pass
+        cache = self.get_cache()
+        cache.mark_clean(self.path)
+        with self.assertLogs("zpretty.cache"):
+            cache.save()
+        self.assertTrue(cache.changed)
+
+    def test_cli_check(self):
+        first_clirunner = MockCLIRunner("--check", self.path)
+        with mock.patch("zpretty.cli.stderr") as stderr:
+            first_clirunner.run()
+        stderr.write.assert_called_once_with("Cache hits: 0, cache misses: 1\n")
+
+        # Share the cache directory with the other runners
+        clirunner = MockCLIRunner("--check", self.path)
+        clirunner._cache_dir = first_clirunner._cache_dir
+        with mock.patch("zpretty.cli.stderr") as stderr:
+            clirunner.run()
+        stderr.write.assert_called_once_with("Cache hits: 1, cache misses: 0\n")
+
+        clirunner = MockCLIRunner("--check", "--no-cache", self.path)
+        clirunner._cache_dir = first_clirunner._cache_dir
+        with mock.patch("zpretty.cli.stderr") as stderr:
+            clirunner.run()
+        stderr.write.assert_not_called()
+
+    def test_cli_inplace(self):
+        with open(self.path, "w") as f:
+            f.write("<div>\n<p></p></div>")
+        clirunner = MockCLIRunner("-i", "-j", "1", self.path)
+        self.assertListEqual(
+            list(clirunner.iter_results([self.path])), [(self.path, False)]
+        )
+        # The file was not pretty, so it is not cached yet
+        self.assertEqual(clirunner.caches[ZPrettifier].entries, {})
+        self.assertListEqual(
+            list(clirunner.iter_results([self.path])), [(self.path, True)]
+        )
+        self.assertListEqual(
+            list(clirunner.iter_results([self.path])), [(self.path, True)]
+        )
+        cache = clirunner.caches[ZPrettifier]
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
@@ -1,12 +1,21 @@
 from importlib.resources import files
+from io import StringIO
 from tempfile import TemporaryDirectory
+from unittest import mock
 from unittest import TestCase
+from zpretty.cli import get_version
+from zpretty.cli import prettify
+from zpretty.cli import walk
 from zpretty.prettifier import ZPrettifier
 from zpretty.tests.mock import MockCLIRunner
 from zpretty.xml import XMLPrettifier
+from zpretty.xmlstream import StreamingXMLPrettifier
 from zpretty.zcml import ZCMLPrettifier
 
 import os
+import re
+import subprocess
+import sys
 
 
 class TestCli(TestCase):
@@ -23,6 +32,26 @@ class TestCli(TestCase):
         self.assertEqual(config.encoding, "utf8")
         self.assertFalse(config.check)
 
+    def test_version(self):
+        with mock.patch("zpretty.cli.stdout") as stdout:
+            with self.assertRaises(SystemExit):
+                MockCLIRunner("--version")
+        stdout.write.assert_called_once_with(f"zpretty {get_version()}\n")
+
+    def test_lazy_imports(self):
+        """Importing the command line module must not import the slow modules"""
+        code = "import sys, zpretty.cli; print(' '.join(sys.modules))"
+        modules = subprocess.check_output([sys.executable, "-c", code], text=True)
+        for module in (
+            "bs4",
+            "concurrent.futures",
+            "importlib.metadata",
+            "lxml",
+            "zpretty.cache",
+            "zpretty.prettifier",
+        ):
+            self.assertNotIn(module, modules.split())
+
     def test_short_options(self):
         config = MockCLIRunner("-i", "-x", "-z").config
         self.assertTrue(all((config.inplace, config.xml, config.zcml)))
@@ -71,10 +100,192 @@ class TestCli(TestCase):
         config = MockCLIRunner("--check").config
         self.assertTrue(config.check)
 
+    def test_jobs(self):
+        config = MockCLIRunner("-j", "3").config
+        self.assertEqual(config.jobs, 3)
+        config = MockCLIRunner("--jobs", "1").config
+        self.assertEqual(config.jobs, 1)
+        self.assertGreaterEqual(MockCLIRunner().config.jobs, 1)
+
+    def test_run_parallel(self):
+        """Running in parallel gives the same results in the same order"""
+        paths = [
+            "zpretty/tests/original/sample_xml.xml",
+            "zpretty/tests/broken/broken.xml",
+            "zpretty/tests/original/sample_html.html",
+            "zpretty/tests/original/sample.zcml",
+        ]
+        serial = MockCLIRunner("-j", "1", *paths)
+        parallel = MockCLIRunner("-j", "2", *paths)
+        self.assertListEqual(
+            list(parallel.iter_results(parallel.good_paths)),
+            list(serial.iter_results(serial.good_paths)),
+        )
+
+        serial = MockCLIRunner("--check", "-j", "1", *paths)
+        parallel = MockCLIRunner("--check", "-j", "2", *paths)
+        with mock.patch("builtins.exit", return_value=None) as mocked:
+            serial.run()
+            parallel.run()
+            self.assertEqual(mocked.call_count, 2)
+        self.assertListEqual(parallel.errors, serial.errors)
+        self.assertListEqual(
+            parallel.errors,
+            [
+                "This file would be rewritten: zpretty/tests/broken/broken.xml "
+                "(first difference at line 2, column 10)"
+            ],
+        )
+
+    def test_run_split(self):
+        """Rendering the elements of each file in parallel gives the same results"""
+        paths = [
+            "zpretty/tests/original/sample_xml.xml",
+            "zpretty/tests/original/sample_html.html",
+        ]
+        serial = MockCLIRunner("-j", "1", *paths)
+        split = MockCLIRunner("-j", "2", "--split", *paths)
+        self.assertTrue(split.config.split)
+        with mock.patch("zpretty.cli.prettify", wraps=prettify) as mocked:
+            results = list(split.iter_results(split.good_paths))
+        self.assertEqual(mocked.call_args.kwargs["jobs"], 2)
+        self.assertListEqual(results, list(serial.iter_results(serial.good_paths)))
+
+    def test_run_low_memory(self):
+        """The XML files are streamed with the same results"""
+        paths = [
+            "zpretty/tests/original/sample_xml.xml",
+            "zpretty/tests/broken/broken.xml",
+            "zpretty/tests/original/sample.zcml",
+        ]
+        low_memory = MockCLIRunner("--low-memory", *paths)
+        self.assertIs(low_memory.choose_prettifier(paths[0]), StreamingXMLPrettifier)
+        self.assertIs(low_memory.choose_prettifier(paths[2]), ZCMLPrettifier)
+        expected = MockCLIRunner("-j", "1", *paths)
+        self.assertListEqual(
+            [
+                (path, "".join(result))
+                for path, result in low_memory.iter_results(paths, True)
+            ],
+            list(expected.iter_results(paths)),
+        )
+        low_memory = MockCLIRunner("--low-memory", "--check", "--no-cache", *paths)
+        self.assertListEqual(
+            [result for path, result in low_memory.iter_results(paths)],
+            [True, (2, 10), True],
+        )
+
+    def test_run_low_memory_inplace(self):
+        """The streamed files replace the original ones only if they changed"""
+        texts = {
+            "changed.xml": "<a>\n<b/>\n</a>",
+            "clean.xml": '<?xml version="1.0" encoding="utf-8"?>\n<a>\n  <b />\n</a>\n',
+        }
+        with TemporaryDirectory() as tmpdir:
+            paths = []
+            for name, text in texts.items():
+                path = os.path.join(tmpdir, name)
+                with open(path, "w") as f:
+                    f.write(text)
+                paths.append(path)
+            stats = [os.stat(path) for path in paths]
+            clirunner = MockCLIRunner("-i", "--low-memory", "--no-cache", *paths)
+            self.assertListEqual(
+                list(clirunner.iter_results(clirunner.good_paths)),
+                list(zip(paths, (False, True))),
+            )
+            self.assertListEqual(sorted(os.listdir(tmpdir)), sorted(texts))
+            for path in paths:
+                with open(path) as f:
+                    self.assertEqual(f.read(), texts["clean.xml"])
+            self.assertEqual(os.stat(paths[1]).st_mtime_ns, stats[1].st_mtime_ns)
+
+    def test_run_parallel_inplace(self):
+        with TemporaryDirectory() as tmpdir:
+            paths = []
+            for idx in range(1, 4):
+                path = os.path.join(tmpdir, f"{idx}.html")
+                with open(path, "w") as f:
+                    f.write("<div>\n<p>" * idx + "</p>\n</div>" * idx)
+                paths.append(path)
+            clirunner = MockCLIRunner("-i", "-j", "2", *paths)
+            self.assertListEqual(
+                list(clirunner.iter_results(clirunner.good_paths)),
+                [(path, False) for path in paths],
+            )
+            for path in paths:
+                self.assertTrue(ZPrettifier(path).check())
+
+    def test_run_report_repairs(self):
+        """The files with some repaired tags are reported"""
+        with TemporaryDirectory() as tmpdir:
+            paths = []
+            for name, text in (
+                ("broken.html", "<div><input>a</input><br>b</br><br>c</br></div>\n"),
+                ("clean.html", "<div><input /><br /></div>\n"),
+            ):
+                path = os.path.join(tmpdir, name)
+                with open(path, "w") as f:
+                    f.write(text)
+                paths.append(path)
+            expected = f"Repaired 3 tags (br, input) in: {paths[0]}\n"
+            for args in (("-j", "1"), ("-j", "2"), ("-j", "1", "--split")):
+                with self.subTest(args=args):
+                    clirunner = MockCLIRunner(*args, *paths)
+                    with mock.patch("zpretty.cli.stdout", new_callable=StringIO):
+                        with mock.patch("zpretty.cli.stderr") as stderr:
+                            clirunner.run()
+                    stderr.write.assert_called_once_with(expected)
+            clirunner = MockCLIRunner("--check", "--no-cache", *paths)
+            with mock.patch("builtins.exit", return_value=None):
+                with mock.patch("zpretty.cli.stderr", new_callable=StringIO) as stderr:
+                    clirunner.run()
+            self.assertTrue(stderr.getvalue().startswith(expected))
+            self.assertIn(
+                f"This file would be rewritten: {paths[0]}", stderr.getvalue()
+            )
+
+    def test_run_inplace(self):
+        """The files are rewritten only if needed, keeping their permissions"""
+        texts = {
+            "changed.html": "<div>\n<p>a</p>\n</div>",
+            "clean.html": "<div>\n  <p>a</p>\n</div>\n",
+            "shorter.html": "<div>\n  <p>a</p>\n</div>\n\n",
+        }
+        with TemporaryDirectory() as tmpdir:
+            paths = []
+            for name, text in texts.items():
+                path = os.path.join(tmpdir, name)
+                with open(path, "w") as f:
+                    f.write(text)
+                os.chmod(path, 0o640)
+                paths.append(path)
+            stats = [os.stat(path) for path in paths]
+            clirunner = MockCLIRunner("-i", "-j", "1", "--no-cache", *paths)
+            self.assertListEqual(
+                list(clirunner.iter_results(clirunner.good_paths)),
+                list(zip(paths, (False, True, False))),
+            )
+            self.assertListEqual(sorted(os.listdir(tmpdir)), sorted(texts))
+            for path, stat in zip(paths, stats):
+                self.assertEqual(os.stat(path).st_mode, stat.st_mode)
+                with open(path) as f:
+                    self.assertEqual(f.read(), "<div>\n  <p>a</p>\n</div>\n")
+            # The clean file was not touched
+            self.assertEqual(os.stat(paths[1]).st_mtime_ns, stats[1].st_mtime_ns)
+
+    def test_run_stream(self):
+        """The prettified text is written to stdout in pieces"""
+        path = str(self.sample_folder_path / "sample_html.html")
+        clirunner = MockCLIRunner("-j", "1", path)
+        ((_, result),) = clirunner.iter_results(clirunner.good_paths, stream=True)
+        self.assertNotIsInstance(result, str)
+        with mock.patch("zpretty.cli.stdout", new_callable=StringIO) as stdout:
+            clirunner.run()
+        self.assertEqual(stdout.getvalue(), ZPrettifier(path)())
+
     def test_run_check(self):
         # XXX increase coverage by improving the mock
-        from unittest import mock
-
         clirunner = MockCLIRunner("--check", "zpretty/tests/original/sample_xml.xml")
         with mock.patch("builtins.exit", return_value=None) as mocked:
             clirunner.run()
@@ -86,6 +297,50 @@ class TestCli(TestCase):
             clirunner.run()
             mocked.assert_called_once_with(1)
 
+    def test_iter_good_paths(self):
+        """The directories are walked lazily, but the paths are still sorted"""
+        clirunner = MockCLIRunner(
+            "zpretty/tests/original/sample_xml.xml",
+            "zpretty/tests/include-exclude",
+            "zpretty/tests/broken/broken.xml",
+            "broken/broken.xml",
+        )
+        paths = clirunner.iter_good_paths()
+        self.assertEqual(next(paths), "zpretty/tests/broken/broken.xml")
+        # All the paths passed on the command line are checked upfront
+        self.assertListEqual(clirunner.errors, ["Cannot open: broken/broken.xml"])
+        self.assertEqual(next(paths), "zpretty/tests/include-exclude/foo/bar/bar.html")
+        remaining = list(paths)
+        self.assertEqual(remaining[-1], "zpretty/tests/original/sample_xml.xml")
+        self.assertListEqual(remaining, sorted(remaining))
+
+    def test_walk_prunes_excluded_directories(self):
+        """Excluded directories are not even listed"""
+        with TemporaryDirectory() as tmpdir:
+            for folder in ("a", "a/.git", "a/.git/objects", "b"):
+                os.mkdir(os.path.join(tmpdir, folder))
+            for filename in ("a/x.pt", "a/.git/y.pt", "a/.git/objects/z.pt", "b.pt"):
+                with open(os.path.join(tmpdir, filename), "w"):
+                    pass
+            scanned = []
+
+            def scandir(path):
+                scanned.append(os.path.relpath(path, tmpdir))
+                return os.scandir(path)
+
+            with mock.patch("zpretty.cli.scandir", scandir):
+                paths = list(
+                    walk(
+                        tmpdir,
+                        re.compile(MockCLIRunner._default_include),
+                        re.compile(MockCLIRunner._default_exclude),
+                    )
+                )
+        self.assertListEqual(
+            paths, [os.path.join(tmpdir, "a/x.pt"), os.path.join(tmpdir, "b.pt")]
+        )
+        self.assertListEqual(scanned, [".", "a", "b"])
+
     def test_good_paths(self):
         """Test the good_paths property"""
         clirunner = MockCLIRunner()
@@ -1,6 +1,8 @@
 from bs4 import BeautifulSoup
 from unittest import TestCase
+from zpretty.elements import compile_template
 from zpretty.elements import PrettyElement
+from zpretty.zcml import ZCMLElement
 
 
 class TestPrettyElements(TestCase):
@@ -108,3 +110,83 @@ class TestPrettyElements(TestCase):
         self.assertEqual(el.getparent().tag, "fake_root")
         self.assertEqual(el.getparent().getparent().tag, "soup")
         self.assertIsNone(el.getparent().getparent().getparent())
+
+    def test_fix_open_self_closing_tags(self):
+        # The XML parser does not know about the HTML self closing tags
+        soup = BeautifulSoup("<root><input><img><b/>x</img>y</input>z</root>", "xml")
+        el = PrettyElement(soup.root)
+        self.assertEqual(el(), "<root><input /><img /><b></b>xyz</root>")
+        self.assertListEqual(el.repaired_tags, ["input", "img"])
+
+    def test_fix_many_open_self_closing_tags(self):
+        soup = BeautifulSoup(f"<root>{'<input>a</input>' * 2000}</root>", "xml")
+        el = PrettyElement(soup.root)
+        self.assertEqual(el(), f"<root>{'<input />a' * 2000}</root>")
+        self.assertEqual(len(el.repaired_tags), 2000)
+
+    def test_kind(self):
+        el = self.get_element("<root>a<!--b--><?c?></root>")
+        self.assertEqual(el.kind, "tag")
+        self.assertEqual(el.tag, "root")
+        self.assertListEqual(
+            [child.kind for child in el.getchildren()],
+            ["text", "comment", "processing_instruction"],
+        )
+        self.assertEqual(el.getparent().getparent().kind, "tag")
+        soup = BeautifulSoup("<!DOCTYPE html>", "html.parser")
+        self.assertEqual(PrettyElement(soup).kind, "soup")
+        self.assertEqual(PrettyElement(soup.contents[0]).kind, "doctype")
+
+    def test_repr(self):
+        el = self.get_element("<root>a<!--b--></root>", level=1)
+        self.assertEqual(repr(el), "<pretty:1:root />")
+        self.assertListEqual(
+            [repr(child) for child in el.getchildren()],
+            ['<pretty:2:"" />', "<pretty:2:!-- />"],
+        )
+
+    def test_slots(self):
+        el = self.get_element("<root />")
+        self.assertFalse(hasattr(el, "__dict__"))
+        with self.assertRaises(AttributeError):
+            el.foo = "bar"
+        # Also the subclasses do not have a __dict__
+        self.assertFalse(hasattr(ZCMLElement(el.context), "__dict__"))
+
+    def test_compile_template(self):
+        el = self.get_element('<root a="1" b="2"></root>', level=1)
+        for template in (
+            "{prefix}<{tag} {attributes}\n{prefix}{before_closing_multiline}>",
+            "{prefix}<{tag}>",
+            "<{tag}/>",
+            "{{literal}} {prefix}",
+            "",
+        ):
+            self.assertEqual(
+                compile_template(template, "  ")(el, el.prefix),
+                template.format(
+                    prefix=el.prefix,
+                    tag=el.tag,
+                    attributes=el.attributes.lstrip(),
+                    before_closing_multiline="  ",
+                ),
+            )
+        # The lead replaces the prefix only at the start of the template
+        self.assertEqual(
+            compile_template("{prefix}<{tag}>{prefix}")(el, ""), "<root>  "
+        )
+        # Templates with conversions are rendered with str.format
+        self.assertEqual(compile_template("{tag!r}")(el, ""), "'root'")
+
+    def test_templates_overridden(self):
+        class CustomElement(PrettyElement):
+            indent = "\t"
+            start_tag_singleline_attributeless_template = "{prefix}<{tag} >"
+
+        el = self.get_element("<root><b></b></root>")
+        custom_el = CustomElement(el.context, level=2)
+        self.assertEqual(custom_el.prefix, "\t\t")
+        self.assertEqual(custom_el(), "\t\t<root ><b ></b></root>")
+        self.assertIn("{prefix}<{tag} >", CustomElement._compiled_templates)
+        self.assertNotIn("{prefix}<{tag} >", PrettyElement._compiled_templates)
+        self.assertEqual(el(), "<root><b></b></root>")
@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+from importlib.resources import files
+from random import Random
+from unittest import TestCase
+from zpretty import format_text
+from zpretty import Formatter
+from zpretty.prettifier import ZPrettifier
+from zpretty.zcml import ZCMLPrettifier
+
+import sys
+
+
+class TestFormatter(TestCase):
+    """Test the library API"""
+
+    sample_folder_path = files("zpretty.tests") / "original"
+
+    def test_format_text(self):
+        self.assertEqual(
+            format_text("<div>\n<p>a</p>\n</div>"), "<div>\n  <p>a</p>\n</div>\n"
+        )
+        self.assertEqual(
+            format_text("<a><b/></a>", "xml"),
+            '<?xml version="1.0" encoding="utf-8"?>\n<a><b /></a>\n',
+        )
+        self.assertEqual(
+            format_text(b"<p>\xe8</p>", options={"encoding": "latin1"}),
+            "<p>&egrave;</p>\n",
+        )
+        with self.assertRaisesRegex(ValueError, "Unknown mode: 'foo'"):
+            format_text("<p>a</p>", "foo")
+
+    def test_formatter(self):
+        formatter = Formatter("zcml")
+        self.assertIs(formatter.prettifier, ZCMLPrettifier)
+        self.assertEqual(repr(formatter), "<Formatter mode='zcml' encoding='utf8'>")
+        text = (self.sample_folder_path / "sample.zcml").read_text()
+        self.assertTrue(formatter.check(text))
+        self.assertEqual(formatter.format(text), text)
+        self.assertEqual("".join(formatter.iter_format(text)), text)
+        self.assertEqual(formatter.first_difference(text.replace("\n  ", "\n")), (2, 3))
+
+    def documents(self):
+        """Return a list of (formatter, text) with many per document details
+
+        Each text has its own doctype, CDATAs and entities,
+        so that mixing the state of two documents would show in the results
+        """
+        random = Random(0)
+        documents = []
+        for path in self.sample_folder_path.iterdir():
+            text = path.read_text()
+            if "<?xml" in text:
+                modes = ("xml", "zcml")
+            else:
+                modes = ("html", "xml", "zcml")
+            for mode in modes:
+                documents.append((Formatter(mode), text))
+        for idx in range(100):
+            cdatas = "".join(
+                f"<![CDATA[{idx} {n} & ]]>" for n in range(random.randrange(5))
+            )
+            text = (
+                f"<!DOCTYPE doc{idx}>\n"
+                f"<root a='{idx}'>&ent{idx};{cdatas}\n"
+                f"{'<div>' * (idx % 7)}&#{idx + 65};{'</div>' * (idx % 7)}</root>"
+            )
+            documents.append((Formatter(random.choice(("html", "xml"))), text))
+        return documents
+
+    def test_threads(self):
+        """Formatting many documents at once gives the same results"""
+        documents = self.documents()
+        expected = [formatter.format(text) for formatter, text in documents]
+        switch_interval = sys.getswitchinterval()
+        # Switch thread as often as possible to interleave the documents
+        sys.setswitchinterval(1e-6)
+        try:
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                for _ in range(3):
+                    results = executor.map(
+                        lambda document: document[0].format(document[1]), documents
+                    )
+                    self.assertListEqual(list(results), expected)
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+    def test_shared_formatter(self):
+        """The same formatter can be used by many threads at once"""
+        formatter = Formatter()
+        texts = [
+            f"<!DOCTYPE d{idx}><p>&e{idx};<![CDATA[{idx}]]></p>" for idx in range(200)
+        ]
+        expected = [ZPrettifier(text=text)() for text in texts]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            self.assertListEqual(list(executor.map(formatter.format, texts)), expected)
+        self.assertTrue(
+            all(expected[idx].startswith(f"<!DOCTYPE d{idx}>") for idx in range(200))
+        )
@@ -1,10 +1,39 @@
+from bs4.dammit import EntitySubstitution
+from html import escape
+from itertools import product
+from random import Random
 from unittest import TestCase
+from zpretty.text import Chunks
 from zpretty.text import endswith_whitespace
+from zpretty.text import first_difference
+from zpretty.text import has_escapable_characters
 from zpretty.text import lstrip_first_line
 from zpretty.text import rstrip_last_line
 from zpretty.text import startswith_whitespace
 
 
+def reference_lstrip_first_line(text):
+    """The original implementation of lstrip_first_line"""
+    if not text:
+        return text
+    if endswith_whitespace(text):
+        text += " "
+    lines = text.splitlines()
+    lines[0] = lines[0].lstrip()
+    return "\n".join(lines)
+
+
+def reference_rstrip_last_line(text):
+    """The original implementation of rstrip_last_line"""
+    if not text:
+        return text
+    if endswith_whitespace(text):
+        text += " "
+    lines = text.splitlines()
+    lines[-1] = lines[-1].rstrip()
+    return "\n".join(lines)
+
+
 class TestFunctions(TestCase):
     """Test functions used by zpretty"""
 
@@ -25,3 +54,119 @@ class TestFunctions(TestCase):
         self.assertEqual(rstrip_last_line(None), None)
         self.assertFalse(endswith_whitespace(None))
         self.assertFalse(startswith_whitespace(None))
+
+    def test_chunks_write(self):
+        chunks = Chunks()
+        chunks.write("")
+        chunks.write(" a ")
+        chunks.lstripping = True
+        chunks.write(" \t")
+        chunks.write(" \n b ")
+        self.assertFalse(chunks.lstripping)
+        self.assertListEqual(chunks, [" a ", "\n b "])
+
+    def test_chunks_rstrip(self):
+        chunks = Chunks(["a", " b", "\n ", " ", "\t"])
+        chunks.rstrip(3)
+        self.assertListEqual(chunks, ["a", " b", "\n "])
+        self.assertEqual(chunks.last(3), "")
+        chunks.rstrip(0)
+        self.assertListEqual(chunks, ["a", " b", "\n"])
+        self.assertEqual(chunks.last(0), "\n")
+        chunks = Chunks([" ", "\t"])
+        chunks.rstrip(0)
+        self.assertListEqual(chunks, [])
+
+    def test_chunks_flush(self):
+        """Only the chunks before the last one that is not blank are flushed"""
+        chunks = Chunks(["a", "\n", " b", " ", "\t"])
+        self.assertListEqual(chunks.flush(), ["a", "\n"])
+        self.assertListEqual(chunks, [" b", " ", "\t"])
+        self.assertListEqual(chunks.flush(), [])
+        # The positions do not change after flushing
+        self.assertEqual(chunks.tell(), 5)
+        self.assertEqual(chunks.last(3), "\t")
+        chunks.rstrip(3)
+        self.assertListEqual(chunks, [" b"])
+        self.assertEqual(chunks.last(3), "")
+        self.assertEqual(chunks.last(2), "b")
+        chunks.write("c")
+        self.assertEqual(chunks.tell(), 4)
+        self.assertListEqual(chunks.flush(final=True), [" b", "c"])
+        self.assertListEqual(chunks.flush(), [])
+        self.assertEqual(chunks.tell(), 4)
+
+    def assertLikeReference(self, texts):
+        for text in texts:
+            self.assertEqual(
+                lstrip_first_line(text), reference_lstrip_first_line(text), text
+            )
+            self.assertEqual(
+                rstrip_last_line(text), reference_rstrip_last_line(text), text
+            )
+
+    def test_lines_helpers_like_reference_short_texts(self):
+        """Check all the short texts made of some interesting characters"""
+        alphabet = ("a", " ", "\t", "\xa0", "\n", "\r", "\r\n", "\x85", "\u2028")
+        for length in range(5):
+            self.assertLikeReference(
+                "".join(chars) for chars in product(alphabet, repeat=length)
+            )
+
+    def test_lines_helpers_like_reference_random_texts(self):
+        """Check some long random texts"""
+        random = Random(0)
+        newlines_only = ("ab", " ", "\t", "\n", " \n ", "\n\n")
+        with_other_breaks = newlines_only + ("\r\n", "\x0c", "\u2029")
+        for alphabet in (newlines_only, with_other_breaks):
+            self.assertLikeReference(
+                "".join(random.choices(alphabet, k=random.randrange(200)))
+                for _ in range(1000)
+            )
+
+    def test_lines_helpers_trailing_whitespace(self):
+        """A space is added when the text ends with a whitespace"""
+        self.assertEqual(lstrip_first_line("a\n"), "a\n ")
+        self.assertEqual(lstrip_first_line(" a\n\t"), "a\n\t ")
+        self.assertEqual(lstrip_first_line(" \t"), "")
+        self.assertEqual(rstrip_last_line("a\n"), "a\n")
+        self.assertEqual(rstrip_last_line("a\r\n b\r\n"), "a\n b\n")
+
+    def test_has_escapable_characters(self):
+        """The texts without escapable characters are not changed by escaping"""
+        random = Random(0)
+        alphabet = ("a", " ", "\n", '"', "'", ";", "&", "<", ">", "fj", "\xe8", "\xa0")
+        for _ in range(1000):
+            text = "".join(random.choices(alphabet, k=random.randrange(10)))
+            if has_escapable_characters(text):
+                continue
+            self.assertEqual(escape(text, quote=False), text)
+            self.assertEqual(EntitySubstitution.substitute_xml(text), text)
+            if text.isascii():
+                self.assertEqual(EntitySubstitution.substitute_html(text), text)
+        self.assertTrue(has_escapable_characters("a & b"))
+        self.assertTrue(has_escapable_characters("<"))
+        self.assertTrue(has_escapable_characters(">"))
+        self.assertFalse(has_escapable_characters("a; b"))
+
+    def split(self, random, text):
+        """Split text at random positions (the pieces can be empty)"""
+        cuts = sorted(random.choices(range(len(text) + 1), k=random.randrange(4)))
+        return [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+    def test_first_difference_blocks(self):
+        """The text can be split in blocks"""
+        self.assertIsNone(first_difference(["a\n", "", "b"], ["a", "\nb"]))
+        self.assertEqual(first_difference(["a\nb", "c"], ["a\nbd"]), (2, 2))
+        self.assertEqual(first_difference(["a\nb", "c", "d"], ["a\nbc"]), (2, 3))
+        self.assertEqual(first_difference(iter(["a"]), ["a", "b"]), (1, 2))
+        random = Random(0)
+        for _ in range(1000):
+            text = "".join(random.choices("ab\n", k=random.randrange(10)))
+            other = "".join(random.choices("ab\n", k=random.randrange(10)))
+            pieces = self.split(random, other)
+            self.assertEqual(
+                first_difference(self.split(random, text), pieces),
+                first_difference(text, pieces),
+                (text, other),
+            )
@@ -0,0 +1,277 @@
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from importlib.resources import files
+from multiprocessing import get_all_start_methods
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import mock
+from unittest import TestCase
+from zpretty.cli import get_version
+from zpretty.client import request_format
+from zpretty.client import ServerError
+from zpretty.client import VersionError
+from zpretty.prettifier import ZPrettifier
+from zpretty.server import FormatHandler
+from zpretty.server import FormatServer
+from zpretty.tests.mock import MockCLIRunner
+from zpretty.zcml import ZCMLPrettifier
+
+import json
+import os
+import signal
+import socket
+
+
+def get_free_port():
+    """Return a localhost port where nobody is listening"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class RunningServer:
+    """Run a server in a thread while in the context"""
+
+    def __init__(self, server):
+        self.server = server
+        self.thread = Thread(target=server.serve_forever)
+
+    def __enter__(self):
+        self.thread.start()
+        return self.server.server_address[1]
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+
+class FixedReplyHandler(BaseHTTPRequestHandler):
+    """Reply to every request with the body of the server, like another service"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+
+class TestServer(TestCase):
+    """Test the zpretty server and its clients"""
+
+    sample_folder_path = files("zpretty.tests") / "original"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FormatServer(port=0, jobs=2)
+        cls.port = cls.server.server_port
+        cls.thread = Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.thread.join()
+        cls.server.server_close()
+
+    def test_request_format(self):
+        self.assertIsNone(request_format("<p>a</p>\n", port=self.port))
+        self.assertEqual(
+            request_format("<div>\n<p>a</p>\n</div>", port=self.port),
+            "<div>\n  <p>a</p>\n</div>\n",
+        )
+        text = (self.sample_folder_path / "sample.zcml").read_text()
+        self.assertIsNone(request_format(text, "zcml", port=self.port))
+        text = text.replace("\n  ", "\n")
+        self.assertEqual(
+            request_format(text, "zcml", port=self.port),
+            ZCMLPrettifier(text=text)(),
+        )
+
+    def test_bad_request(self):
+        with self.assertRaisesRegex(ServerError, "Unknown mode: 'foo'"):
+            request_format("<p>a</p>", "foo", port=self.port)
+        with self.assertRaisesRegex(ServerError, "The text must be a string"):
+            request_format(1, port=self.port)
+
+    def post(self, body, headers):
+        """Send a raw request to the server, return its status and reply"""
+        connection = HTTPConnection("127.0.0.1", self.port)
+        try:
+            connection.request("POST", "/", body, headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def test_not_json_request(self):
+        """A web page cannot make a browser send us a simple cross origin POST"""
+        body = b'{"text": "<div><p>a</p></div>"}'
+        for headers in ({}, {"Content-Type": "text/plain"}):
+            status, reply = self.post(body, headers)
+            self.assertEqual(status, 415)
+            self.assertIn(b"The request must be JSON", reply)
+        status, reply = self.post(
+            body, {"Content-Type": "application/json; charset=utf-8"}
+        )
+        self.assertEqual(status, 200)
+        self.assertIn(b"changed", reply)
+
+    def test_request_too_big(self):
+        with mock.patch.object(FormatHandler, "max_length", 20):
+            with self.assertRaisesRegex(ServerError, "at most 20 bytes"):
+                request_format("<p>a</p>", port=self.port)
+
+    def test_unexpected_reply(self):
+        """The replies of a service that is not zpretty are errors"""
+        server = HTTPServer(("127.0.0.1", 0), FixedReplyHandler)
+        with RunningServer(server) as port:
+            for body in (
+                b"<html></html>",
+                b"[1, 2]",
+                {},
+                {"status": "changed"},
+                {"status": "changed", "text": 1},
+            ):
+                if isinstance(body, dict):
+                    body = json.dumps(dict(body, version=get_version())).encode()
+                server.body = body
+                with self.assertRaisesRegex(ServerError, "Unexpected reply"):
+                    request_format("<p>a</p>", port=port)
+
+    def test_other_version(self):
+        """The servers running another version of zpretty are not used"""
+        server = HTTPServer(("127.0.0.1", 0), FixedReplyHandler)
+        server.body = b'{"status": "unchanged", "version": "0.1"}'
+        path = "zpretty/tests/original/sample_html.html"
+        with RunningServer(server) as port:
+            with self.assertRaisesRegex(VersionError, "runs zpretty '0.1'"):
+                request_format("<p>a</p>", port=port)
+            clirunner = MockCLIRunner("--client", "--port", str(port), path)
+            with mock.patch(
+                "zpretty.client.request_format", wraps=request_format
+            ) as mocked:
+                self.assertListEqual(
+                    list(clirunner.iter_results([path, path])),
+                    [(path, ZPrettifier(path)())] * 2,
+                )
+            self.assertFalse(clirunner.server_available)
+            mocked.assert_called_once()
+
+    def test_server_not_answering(self):
+        """The client does not wait forever for a server that does not answer"""
+        with socket.socket() as listener:
+            listener.bind(("127.0.0.1", 0))
+            listener.listen()
+            port = listener.getsockname()[1]
+            with mock.patch("zpretty.client.TIMEOUT", 0.1):
+                with self.assertRaises(OSError):
+                    request_format("<p>a</p>", port=port)
+                path = "zpretty/tests/original/sample_html.html"
+                clirunner = MockCLIRunner("--client", "--port", str(port), path)
+                self.assertListEqual(
+                    list(clirunner.iter_results([path])), [(path, ZPrettifier(path)())]
+                )
+            self.assertFalse(clirunner.server_available)
+
+    def test_worker_died(self):
+        """The pool is replaced when a worker dies"""
+        server = FormatServer(port=0, jobs=1)
+        with RunningServer(server) as port:
+            executor = server.executor
+            (pid,) = executor._processes
+            os.kill(pid, signal.SIGKILL)
+            with self.assertRaisesRegex(ServerError, "BrokenProcessPool"):
+                request_format("<div><p>a</p></div>", port=port)
+            self.assertIsNot(server.executor, executor)
+            self.assertEqual(
+                request_format("<div><p>a</p></div>", port=port),
+                "<div><p>a</p></div>\n",
+            )
+
+    def test_start_methods(self):
+        """The workers can be started without forking the server"""
+        for start_method in ("spawn", "forkserver"):
+            if start_method not in get_all_start_methods():
+                continue
+            with self.subTest(start_method=start_method):
+                with mock.patch.object(FormatServer, "start_method", start_method):
+                    server = FormatServer(port=0, jobs=1)
+                self.assertEqual(
+                    server.executor._mp_context.get_start_method(), start_method
+                )
+                with RunningServer(server) as port:
+                    for _ in range(3):
+                        self.assertEqual(
+                            request_format("<div>\n<p>a</p>\n</div>", port=port),
+                            "<div>\n  <p>a</p>\n</div>\n",
+                        )
+                with self.assertRaises(OSError):
+                    request_format("<p>a</p>", port=port)
+
+    def test_server_not_running(self):
+        with self.assertRaises(OSError):
+            request_format("<p>a</p>", port=get_free_port())
+
+    def assertClientResults(self, *args):
+        """Check that the client gives the same results of the in-process run"""
+        clirunner = MockCLIRunner("--client", "--port", str(self.port), *args)
+        results = list(clirunner.iter_results(clirunner.good_paths))
+        self.assertTrue(clirunner.server_available)
+        expected = MockCLIRunner("-j", "1", *args)
+        self.assertListEqual(results, list(expected.iter_results(expected.good_paths)))
+        return results
+
+    def test_client(self):
+        paths = [
+            "zpretty/tests/original/sample_xml.xml",
+            "zpretty/tests/broken/broken.xml",
+            "zpretty/tests/original/sample_html.html",
+            "zpretty/tests/original/sample.zcml",
+        ]
+        self.assertClientResults(*paths)
+        results = self.assertClientResults("--check", "--no-cache", *paths)
+        self.assertListEqual(
+            [result for path, result in results], [(2, 10), True, True, True]
+        )
+
+    def test_client_inplace(self):
+        with TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "1.html")
+            with open(path, "w") as f:
+                f.write("<div>\n<p>a</p>\n</div>")
+            clirunner = MockCLIRunner("--client", "--port", str(self.port), "-i", path)
+            self.assertListEqual(
+                list(clirunner.iter_results(clirunner.good_paths)), [(path, False)]
+            )
+            self.assertTrue(ZPrettifier(path).check())
+            self.assertListEqual(
+                list(clirunner.iter_results(clirunner.good_paths)), [(path, True)]
+            )
+
+    def test_client_fallback(self):
+        """Without a server the files are prettified in process"""
+        path = "zpretty/tests/original/sample_html.html"
+        clirunner = MockCLIRunner("--client", "--port", str(get_free_port()), path)
+        with mock.patch(
+            "zpretty.client.request_format", wraps=request_format
+        ) as mocked:
+            self.assertListEqual(
+                list(clirunner.iter_results([path, path])),
+                [(path, ZPrettifier(path)())] * 2,
+            )
+        self.assertFalse(clirunner.server_available)
+        # The server is not asked again once it turned out to be unreachable
+        mocked.assert_called_once()
+
+    def test_serve(self):
+        port = get_free_port()
+        clirunner = MockCLIRunner("--serve", "--port", str(port), "-j", "3")
+        with mock.patch("zpretty.server.serve") as serve:
+            clirunner.run()
+        serve.assert_called_once_with(port, 3)
@@ -28,6 +28,25 @@ class TestZpretty(TestCase):
         observed = prettifier()
         expected = filename_path.read_text()
         self.assertListEqual(observed.splitlines(), expected.splitlines())
+        self.assertEqual(XMLPrettifier(filename_path, jobs=2)(), observed)
+
+    def test_prerender(self):
+        """The children of the document element are rendered in parallel"""
+        text = (
+            '<?xml version="1.0"?>\n<root>\n'
+            + "".join(
+                f"<a n='{idx}'><b>{idx}</b>   </a><!-- {idx} -->" for idx in range(20)
+            )
+            + "</root>"
+        )
+        prettifier = XMLPrettifier(text=text, jobs=3)
+        shard_parent = prettifier.get_shard_parent()
+        self.assertEqual(shard_parent.tag, "root")
+        prerendered = prettifier.prerender()
+        children = [child for child in shard_parent.getchildren() if child.tag == "a"]
+        self.assertListEqual(list(prerendered), children)
+        self.assertEqual(prerendered[children[0]], '  <a n="0"><b>0</b>\n  </a>')
+        self.assertEqual(prettifier(), XMLPrettifier(text=text)())
 
     def test_newline_between_attributes(self):
         """See #84"""
@@ -42,3 +61,11 @@ class TestZpretty(TestCase):
 
     def test_sample_txt(self):
         self.prettify("sample.txt")
+
+    def test_deeply_nested(self):
+        depth = 2000
+        text = f"{'<a>' * depth}<b />{'</a>' * depth}\n"
+        prettifier = XMLPrettifier(text=text)
+        self.assertEqual(
+            prettifier(), f'<?xml version="1.0" encoding="utf-8"?>\n{text}'
+        )
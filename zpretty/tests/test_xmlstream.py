@@ -0,0 +1,77 @@
+from importlib.resources import files
+from unittest import TestCase
+from zpretty.xml import XMLPrettifier
+from zpretty.xmlstream import StreamingXMLPrettifier
+
+
+class TinyBlocksPrettifier(StreamingXMLPrettifier):
+    """Read the input a few characters at a time"""
+
+    block_size = 3
+
+
+class TestStreamingXMLPrettifier(TestCase):
+    """Test the streaming XML prettifier"""
+
+    maxDiff = None
+
+    def assertLikeXMLPrettifier(self, filename="", text=""):
+        """Check that the text is prettified like XMLPrettifier does"""
+        expected = XMLPrettifier(filename, text)
+        for klass in (StreamingXMLPrettifier, TinyBlocksPrettifier):
+            self.assertEqual(klass(filename, text)(), expected())
+            self.assertEqual(
+                klass(filename, text).first_difference(), expected.first_difference()
+            )
+
+    def test_samples(self):
+        for folder in ("original", "broken"):
+            for path in (files("zpretty.tests") / folder).iterdir():
+                with self.subTest(path=path.name):
+                    self.assertLikeXMLPrettifier(path)
+
+    def test_block_boundaries(self):
+        """CDATAs, doctypes, entities and blank lines can span many blocks"""
+        self.assertLikeXMLPrettifier(
+            text=(
+                "\N{BYTE ORDER MARK}<!DOCTYPE root [\n<!ENTITY e 'v'>\n\n]>\n"
+                "<root a='x&y'>\n\n  &e; &amp; &#65; & <![CDATA[ 1 \n\n < 2 ]]>\n"
+                "<b>  <![CDATA[ 3 ]]>  </b>\r\n \t \r\n<!-- c \n\n -->"
+                "<?pi data?><c xmlns:x='u'><x:d x:f='1' e='2'/></c>\n</root>\n\n"
+            )
+        )
+        # This CDATA does not end, the rest of the document is read to know that
+        self.assertLikeXMLPrettifier(text="<a>\n<![CDATA[ <b>\n\n</b> </a>\n")
+
+    def test_not_xml(self):
+        """Like XMLPrettifier, what does not look like XML is not touched"""
+        for text in ("", "foo bar", "\n\n<a/>"):
+            self.assertEqual(TinyBlocksPrettifier(text=text)(), text)
+            self.assertIsNone(TinyBlocksPrettifier(text=text).first_difference())
+
+    def test_first_difference_stops_reading(self):
+        text = (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            + "<root>\n"
+            + "<a>b</a>\n" * 1000
+            + "</root>\n"
+        )
+        prettifier = TinyBlocksPrettifier(text=text)
+        self.assertTupleEqual(prettifier.first_difference(), (3, 1))
+        self.assertFalse(prettifier.soup.closed)
+        self.assertTrue(TinyBlocksPrettifier(text=text.replace("<a>", "  <a>")).check())
+
+    def test_bounded_memory(self):
+        """The elements are removed from the tree as soon as they are written"""
+        text = "<root>" + "<a><b>c</b></a>\n" * 1000 + "</root>"
+        prettifier = TinyBlocksPrettifier(text=text)
+        pieces = []
+        sizes = set()
+        for piece in prettifier.iter_render(size=4):
+            pieces.append(piece)
+            for tag in prettifier.soup.tagStack:
+                sizes.add(len(tag.contents))
+        self.assertGreater(len(pieces), 100)
+        self.assertLess(max(sizes), 10)
+        self.assertEqual("".join(pieces), XMLPrettifier(text=text)())
+        self.assertListEqual(prettifier.soup.contents, [])
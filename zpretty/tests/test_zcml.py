@@ -230,5 +230,30 @@ class TestZpretty(TestCase):
         expected = filename_path.read_text()
         self.assertListEqual(observed.splitlines(), expected.splitlines())
 
+    def test_xml_attribute_ranks(self):
+        soup = ZCMLPrettifier(
+            text=(
+                '<configure xmlns:browser="http://namespaces.zope.org/browser">'
+                '<browser:page title="t" layer="l" name="n" for="*" foo="f" />'
+                '<include title="t" package="p" />'
+                "</configure>"
+            )
+        ).soup
+        page = ZCMLElement(soup.find("page"))
+        self.assertEqual(page.attributes.xml_attribute_ranks()["title"], 10)
+        self.assertListEqual(
+            sorted(page.context.attrs, key=page.attributes.sort_attributes),
+            ["name", "for", "layer", "title", "foo"],
+        )
+        include = ZCMLElement(soup.find("include"))
+        self.assertIs(
+            include.attributes.xml_attribute_ranks(),
+            ZCMLAttributes._xml_attribute_ranks_fallback,
+        )
+        self.assertListEqual(
+            sorted(include.context.attrs, key=include.attributes.sort_attributes),
+            ["title", "package"],
+        )
+
     def test_zcml(self):
         self.prettify("sample.zcml")
@@ -1,6 +1,10 @@
 from importlib.resources import files
+from threading import Event
+from threading import Thread
+from unittest import mock
 from unittest import TestCase
 from zpretty.prettifier import ZPrettifier
+from zpretty.prettifier import ZSoup
 
 
 class TestZpretty(TestCase):
@@ -17,6 +21,16 @@ class TestZpretty(TestCase):
         self.assertFalse(prettifier.check())
         observed = prettifier()
         self.assertEqual(observed, expected)
+        self.assertIterRender(original)
+        self.assertEqual(ZPrettifier(text=original, jobs=2)(), expected)
+
+    def assertIterRender(self, text):
+        """Check that iter_render yields the text returned by the prettifier"""
+        expected = ZPrettifier(text=text)()
+        for size in (1, 2, 1024):
+            pieces = list(ZPrettifier(text=text).iter_render(size))
+            self.assertNotIn("", pieces)
+            self.assertEqual("".join(pieces), expected)
 
     def prettify(self, filename):
         """Run prettify on filename and check that the output is equal to
@@ -28,6 +42,8 @@ class TestZpretty(TestCase):
         observed = prettifier()
         expected = filename_path.read_text()
         self.assertListEqual(observed.splitlines(), expected.splitlines())
+        self.assertIterRender(prettifier.original_text)
+        self.assertEqual(ZPrettifier(filename_path, jobs=2)(), observed)
 
     def test_format_self_closing_tag(self):
         self.assertPrettified("<tal:test />", "<tal:test />\n")
@@ -152,6 +168,12 @@ class TestZpretty(TestCase):
             '<textarea>\n  <tal:content replace="structure view/value" />\n</textarea>\n',  # noqa: E501
         )
 
+    def test_rcdata_with_comments(self):
+        self.assertPrettified(
+            "<title><!-- a --> <b>&nbsp;</b></title><textarea>a & b</textarea>",
+            "<title><!-- a -->\n  <b>&nbsp;</b></title><textarea>a & b</textarea>\n",
+        )
+
     def test_element_repr(self):
         prettifier = ZPrettifier(text="")
         self.assertEqual(repr(prettifier.root), "<pretty:-1:null_tag_name />")
@@ -181,6 +203,32 @@ class TestZpretty(TestCase):
     def test_entities(self):
         self.assertPrettified("<root>&nbsp;</root>", "<root>&nbsp;</root>\n")
 
+    def test_many_entities(self):
+        entities = "".join(f"&#{idx};&foo{idx};" for idx in range(1, 13))
+        self.assertPrettified(
+            f"<root>{entities}&nbsp;&NBSP;&#1; & ;</root>",
+            f"<root>{entities}&nbsp;&NBSP;&#1; & ;</root>\n",
+        )
+
+    def test_cdata_and_doctype(self):
+        self.assertPrettified(
+            "<!DOCTYPE html><root><![CDATA[ & &nbsp; <!DOCTYPE x> ]]></root>",
+            "<!DOCTYPE html>\n<root><![CDATA[ & &nbsp; <!DOCTYPE x> ]]></root>\n",
+        )
+
+    def test_many_cdatas(self):
+        cdatas = "".join(f"<![CDATA[{idx} &nbsp; & ]]>" for idx in range(100))
+        self.assertPrettified(
+            f"<root>{cdatas}&nbsp;</root>", f"<root>{cdatas}&nbsp;</root>\n"
+        )
+
+    def test_parse_once(self):
+        with mock.patch("zpretty.prettifier.ZSoup", wraps=ZSoup) as parse:
+            ZPrettifier(text="<root></root>")
+            ZPrettifier(text="<!DOCTYPE html><root></root>")
+            ZPrettifier(text="<?php echo 1 ?><root></root>")
+        self.assertEqual(parse.call_count, 3)
+
     def test_single_quotes_in_attrs(self):
         self.assertPrettified('<root a="\'" />', '<root a="\'"></root>\n')
 
@@ -221,3 +269,98 @@ class TestZpretty(TestCase):
 
     def test_text_file(self):
         self.prettify("sample.txt")
+
+    def test_iter_render(self):
+        prettifier = ZPrettifier(text="<div>\n<p>a</p>\n</div>")
+        self.assertListEqual(
+            list(prettifier.iter_render(1)),
+            ["<div>", "\n", "  <p>", "a", "</p>", "\n", "</div>", "\n"],
+        )
+        self.assertListEqual(list(ZPrettifier(text="a").iter_render()), ["a", "\n"])
+        self.assertListEqual(list(ZPrettifier(text="").iter_render()), [])
+
+    def test_first_difference(self):
+        self.assertIsNone(
+            ZPrettifier(text="<div>\n  <p>a</p>\n</div>\n").first_difference()
+        )
+        self.assertIsNone(ZPrettifier(text="").first_difference())
+        self.assertTupleEqual(
+            ZPrettifier(text="<div>\n<p>a</p>\n</div>\n").first_difference(), (2, 1)
+        )
+        self.assertTupleEqual(
+            ZPrettifier(text="<div>\n  <p>a</p>  \n</div>\n").first_difference(),
+            (2, 11),
+        )
+        # The prettified text is a prefix of the original one
+        self.assertTupleEqual(
+            ZPrettifier(text="<div></div>\n\n").first_difference(), (2, 1)
+        )
+        # The prettified text is longer than the original one
+        self.assertTupleEqual(
+            ZPrettifier(text="<div></div>").first_difference(), (1, 12)
+        )
+
+    def test_first_difference_stops_rendering(self):
+        def iter_render(prettifier):
+            yield "<div>\n"
+            yield "  <p>"
+            raise AssertionError("The rendering should have stopped")
+
+        prettifier = ZPrettifier(text="<div>\n<p>a</p>\n</div>\n")
+        with mock.patch.object(ZPrettifier, "iter_render", iter_render):
+            self.assertTupleEqual(prettifier.first_difference(), (2, 1))
+
+    def test_prerender_nothing(self):
+        """Without many children with content nothing is rendered in parallel"""
+        self.assertDictEqual(ZPrettifier(text="<p>a</p> b", jobs=2).prerender(), {})
+        text = "<div><!-- a --><br /> b</div>"
+        prettifier = ZPrettifier(text=text, jobs=2)
+        self.assertEqual(prettifier.get_shard_parent().tag, "div")
+        self.assertDictEqual(prettifier.prerender(), {})
+        prettifier = ZPrettifier(text=text + text)
+        self.assertIs(prettifier.get_shard_parent(), prettifier.root)
+        self.assertDictEqual(prettifier.prerender(), {})
+        with mock.patch("zpretty.prettifier.platform", "darwin"):
+            self.assertDictEqual(ZPrettifier(text=text + text, jobs=2).prerender(), {})
+
+    def test_repaired_tags(self):
+        """The end tags of the self closing elements with content are counted"""
+        text = "<div><input>a</input><br>b</br><img><p>x</p></img></div>"
+        prettifier = ZPrettifier(text=text)
+        self.assertEqual(prettifier(), "<div><input />a<br />b<img /><p>x</p></div>\n")
+        self.assertListEqual(prettifier.repaired_tags, ["input", "br", "img"])
+        self.assertIs(prettifier.root.repaired_tags, prettifier.repaired_tags)
+        for text, expected in (
+            ("<br><br/>x", "<br /><br />x\n"),
+            ("<input /><br>", "<input /><br />\n"),
+        ):
+            prettifier = ZPrettifier(text=text)
+            self.assertEqual(prettifier(), expected)
+            self.assertListEqual(prettifier.repaired_tags, [])
+
+    def test_prerender_threads(self):
+        """Nothing is rendered in parallel when other threads are running"""
+        text = "<div><p>a</p><p>b</p></div>"
+        self.assertEqual(len(ZPrettifier(text=text, jobs=2).prerender()), 2)
+        results = []
+        thread = Thread(
+            target=lambda: results.append(ZPrettifier(text=text, jobs=2).prerender())
+        )
+        thread.start()
+        thread.join()
+        self.assertListEqual(results, [{}])
+        stop = Event()
+        thread = Thread(target=stop.wait)
+        thread.start()
+        try:
+            prettifier = ZPrettifier(text=text, jobs=2)
+            self.assertDictEqual(prettifier.prerender(), {})
+            self.assertEqual(prettifier(), ZPrettifier(text=text)())
+        finally:
+            stop.set()
+            thread.join()
+
+    def test_deeply_nested(self):
+        depth = 2000
+        text = f"{'<div>' * depth}<tal:x />{'</div>' * depth}\n"
+        self.assertEqual(ZPrettifier(text=text)(), text)
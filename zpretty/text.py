@@ -1,3 +1,34 @@
+from os.path import commonprefix
+
+# The characters, other than "\n", that break lines (see str.splitlines)
+_other_line_breaks = "\r\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+_other_ascii_line_breaks = "\r\v\f\x1c\x1d\x1e"
+
+
+def _breaks_lines_only_with_newlines(text):
+    """Check if "\\n" is the only line break in text
+
+    Looking for each character with `in` is much faster than using a regex
+    """
+    if text.isascii():
+        other_line_breaks = _other_ascii_line_breaks
+    else:
+        other_line_breaks = _other_line_breaks
+    for char in other_line_breaks:
+        if char in text:
+            return False
+    return True
+
+
+def has_escapable_characters(text):
+    """Check if text contains characters that are escaped in markup
+
+    Among the ASCII characters only "&", "<" and ">" are escaped
+    by html.escape and by the bs4 EntitySubstitution methods
+    """
+    return "&" in text or "<" in text or ">" in text
+
+
 def startswith_whitespace(text):
     """Check if text starts with a whitespace
 
@@ -19,22 +50,166 @@ def endswith_whitespace(text):
 
 
 def lstrip_first_line(text):
-    """lstrip only the first line of text"""
+    """lstrip only the first line of text
+
+    If the text ends with a whitespace a space is added to it.
+
+    Only the first line is looked at, unless the text breaks lines
+    with something else than "\\n": in that case all the line breaks
+    are normalized to "\\n" like str.splitlines would do.
+    """
     if not text:
         return text
-    if endswith_whitespace(text):
+    if text[-1].isspace():
         text += " "
-    lines = text.splitlines()
-    lines[0] = lines[0].lstrip()
-    return "\n".join(lines)
+    if not _breaks_lines_only_with_newlines(text):
+        lines = text.splitlines()
+        lines[0] = lines[0].lstrip()
+        return "\n".join(lines)
+    if not text[0].isspace():
+        return text
+    idx = text.find("\n")
+    if idx == -1:
+        return text.lstrip()
+    return text[:idx].lstrip() + text[idx:]
 
 
 def rstrip_last_line(text):
-    """rstrip only the last line of text"""
+    """rstrip only the last line of text
+
+    Only the last line is looked at, unless the text breaks lines
+    with something else than "\\n" (see lstrip_first_line).
+    """
     if not text:
         return text
-    if endswith_whitespace(text):
-        text += " "
-    lines = text.splitlines()
-    lines[-1] = lines[-1].rstrip()
-    return "\n".join(lines)
+    if not _breaks_lines_only_with_newlines(text):
+        if text[-1].isspace():
+            text += " "
+        lines = text.splitlines()
+        lines[-1] = lines[-1].rstrip()
+        return "\n".join(lines)
+    if not text[-1].isspace():
+        return text
+    idx = text.rfind("\n") + 1
+    return text[:idx] + text[idx:].rstrip()
+
+
+def first_difference(text, pieces):
+    """Return the line and the column where the text made joining pieces
+    differs for the first time from text, None if they are equal
+
+    text can also be an iterable of strings (e.g. the blocks of a file)
+    that are joined to get the text.
+    The pieces (and the blocks) are consumed only until the first difference
+    is found.
+    Lines and columns are counted from 1.
+    """
+    blocks = iter((text,) if isinstance(text, str) else text)
+    text = ""
+    position = 0
+    # The lines in the blocks that have been compared and dropped
+    # and the length of the last one
+    lines = 0
+    tail = 0
+    for piece in pieces:
+        end = position + len(piece)
+        while len(text) < end:
+            block = next(blocks, None)
+            if block is None:
+                break
+            dropped = text[:position]
+            newlines = dropped.count("\n")
+            if newlines:
+                lines += newlines
+                tail = len(dropped) - dropped.rfind("\n") - 1
+            else:
+                tail += len(dropped)
+            text = text[position:] + block
+            end -= position
+            position = 0
+        if not text.startswith(piece, position):
+            position += len(commonprefix((piece, text[position:end])))
+            break
+        position = end
+    else:
+        if position == len(text) and not any(blocks):
+            return None
+    line = lines + text.count("\n", 0, position) + 1
+    newline = text.rfind("\n", 0, position)
+    if newline == -1:
+        return line, tail + position + 1
+    return line, position - newline
+
+
+# The whitespace characters that do not break lines (see str.splitlines)
+BLANKS = (
+    "\t\x1f \xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008"
+    "\u2009\u200a\u202f\u205f\u3000"
+)
+
+
+class Chunks(list):
+    """A list of text chunks that will be joined to get a text
+
+    Stripping the first or the last line of a part of the text
+    only touches the chunks at the boundaries of that part,
+    so we can build a text without copying it over and over.
+    The text is expected to use only "\\n" to break lines.
+
+    The parts of the text are identified by the position of their first chunk,
+    see tell.
+    The chunks that cannot be touched anymore can be flushed,
+    which is useful to stream the text.
+    """
+
+    # When true, the blanks at the start of the next chunks are stripped
+    lstripping = False
+    # The number of chunks that have been flushed
+    offset = 0
+
+    def tell(self):
+        """Return the position of the next chunk that will be written"""
+        return self.offset + len(self)
+
+    def write(self, text):
+        """Append text to the chunks"""
+        if self.lstripping:
+            text = text.lstrip(BLANKS)
+            if not text:
+                return
+            self.lstripping = False
+        elif not text:
+            return
+        self.append(text)
+
+    def rstrip(self, start):
+        """rstrip the last line of the chunks written after the start position"""
+        while self.tell() > start:
+            chunk = self[-1].rstrip(BLANKS)
+            if chunk:
+                self[-1] = chunk
+                return
+            self.pop()
+
+    def last(self, start):
+        """Return the last character written after the start position"""
+        if self.tell() > start:
+            return self[-1][-1]
+        return ""
+
+    def flush(self, final=False):
+        """Remove and return the chunks that cannot be touched anymore
+
+        rstrip stops at the last chunk that is not made only of blanks,
+        so the chunks before it will not be touched.
+        If final is true all the chunks are returned.
+        """
+        idx = len(self)
+        if not final:
+            idx = max(idx - 1, 0)
+            while idx > 0 and not self[idx].strip(BLANKS):
+                idx -= 1
+        flushed = self[:idx]
+        del self[:idx]
+        self.offset += idx
+        return flushed
@@ -1,10 +1,13 @@
-from bs4 import BeautifulSoup
 from bs4.builder import LXMLTreeBuilderForXML
-from bs4.element import NavigableString
 from logging import getLogger
 from zpretty.attributes import PrettyAttributes
+from zpretty.elements import COMMENT
+from zpretty.elements import DOCTYPE
 from zpretty.elements import PrettyElement
+from zpretty.elements import PROCESSING_INSTRUCTION
+from zpretty.elements import TEXT
 from zpretty.prettifier import ZPrettifier
+from zpretty.text import has_escapable_characters
 
 logger = getLogger(__name__)
 
@@ -14,6 +17,17 @@ class AnyIn:
         return True
 
 
+def attribute_ranks(names):
+    """Return a dict that maps each attribute name to its position in names
+
+    Like for tuple.index, the first position of a repeated name wins
+    """
+    ranks = {}
+    for idx, name in enumerate(names):
+        ranks.setdefault(name, idx)
+    return ranks
+
+
 class XMLAttributes(PrettyAttributes):
     """Customized attribute formatter for zcml"""
 
@@ -23,15 +37,32 @@ class XMLAttributes(PrettyAttributes):
     _tal_multiline_attributes = ()
     _xml_attribute_order = ()
     _tal_attribute_order = ()
+    # The ranks of the attributes of our element, resolved when first needed
+    _xml_ranks = None
+
+    @classmethod
+    def _build_ranks(cls):
+        """Precompute the tables used to sort the attributes of this class"""
+        super()._build_ranks()
+        cls._xml_attribute_ranks = attribute_ranks(cls._xml_attribute_order)
+
+    def xml_attribute_ranks(self):
+        """Return a dict that maps the attribute names to their rank"""
+        return self._xml_attribute_ranks
 
     def sort_attributes(self, name):
         """Sort ZCML attributes in a consistent way"""
-        if name in self._xml_attribute_order:
-            return (100 + self._xml_attribute_order.index(name), name)
+        ranks = self._xml_ranks
+        if ranks is None:
+            ranks = self._xml_ranks = self.xml_attribute_ranks()
+        rank = ranks.get(name)
+        if rank is not None:
+            return (100 + rank, name)
         return super().sort_attributes(name)
 
 
 class XMLElement(PrettyElement):
+    __slots__ = ()
     attribute_klass = XMLAttributes
     preserve_text_whitespace_elements = AnyIn()
 
@@ -42,8 +73,11 @@ class XMLElement(PrettyElement):
         # Just check if the element has some content.
         return not self.getchildren()
 
-    @property
-    def tag(self):
+    def must_be_closed(self):
+        """XML elements are never fixed"""
+        return False
+
+    def get_tag(self):
         """Return the tag name"""
         prefix = getattr(self.context, "prefix", "")
         if not prefix:
@@ -56,34 +90,30 @@ class XMLElement(PrettyElement):
 
         Convert the text characters to html entities
         """
-        if not isinstance(self.context, NavigableString):
-            return ""
-        if self.is_comment():
+        kind = self.kind
+        if kind == COMMENT:
             return self.context
-        return self.escaper.substitute_xml(self.context.string)
+        if kind not in (TEXT, DOCTYPE, PROCESSING_INSTRUCTION):
+            return ""
+        string = self.context.string
+        if not has_escapable_characters(string):
+            return string
+        return self.escaper.substitute_xml(string)
 
 
 class XMLPrettifier(ZPrettifier):
     """Prettify according to the ZCML style guide"""
 
     parser = "xml"
+    builder = None
     pretty_element = XMLElement
 
     def get_soup(self, text):
-        """Tries to get the soup from the given test
+        """Get the soup from the given text
 
-        If the text is not some xml like think a dummy element will be used to wrap it.
+        The XML builder always returns a soup, even if the text is not XML,
+        so there is no need to parse the text again wrapped in a dummy element.
         """
-        original_soup = BeautifulSoup(
-            text,
-            self.parser,
-            builder=LXMLTreeBuilderForXML(preserve_whitespace_tags=AnyIn()),
-        )
-        if original_soup.is_xml:
-            return original_soup
-
-        markup = "<{null}>{text}</{null}>".format(
-            null=self.pretty_element.null_tag_name, text=text
+        return self.parse(
+            text, builder=LXMLTreeBuilderForXML(preserve_whitespace_tags=AnyIn())
         )
-        wrapped_soup = BeautifulSoup(markup, self.parser)
-        return getattr(wrapped_soup, self.pretty_element.null_tag_name)
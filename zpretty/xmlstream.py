@@ -0,0 +1,307 @@
+from bs4.builder import LXMLTreeBuilderForXML
+from collections import deque
+from functools import partial
+from sys import stdin
+from zpretty.elements import DOCTYPE
+from zpretty.elements import TEXT
+from zpretty.prettifier import ZSoup
+from zpretty.text import first_difference
+from zpretty.xml import AnyIn
+from zpretty.xml import XMLElement
+from zpretty.xml import XMLPrettifier
+
+import re
+
+
+class StreamingSoup(ZSoup):
+    """A soup that grows while the markup is fed to it piece by piece"""
+
+    def __init__(self, prettifier):
+        builder = LXMLTreeBuilderForXML(preserve_whitespace_tags=AnyIn())
+        super().__init__("", "xml", prettifier, builder=builder)
+        # BeautifulSoup parses the markup when it is created: start over
+        self.reset()
+        builder.initialize_soup(self)
+        self.lxml_parser = builder.parser_for(None)
+        self.closed = False
+
+    def feed(self, markup):
+        """Parse some more markup"""
+        self.lxml_parser.feed(markup)
+
+    def close(self):
+        """Close the parser and all the tags that are still open"""
+        self.lxml_parser.close()
+        self.endData()
+        while self.currentTag.name != self.ROOT_TAG_NAME:
+            self.popTag()
+        self.closed = True
+
+    def is_open(self, tag, level):
+        """Check if the tag at the given level can still get some content"""
+        if self.closed:
+            return False
+        stack = self.tagStack
+        return len(stack) > level + 1 and stack[level + 1] is tag
+
+
+class StreamingXMLElement(XMLElement):
+    """An XML element whose content is parsed while it is rendered
+
+    The methods that look at the children of the element
+    parse the document only as far as they need to.
+    """
+
+    __slots__ = ("prettifier",)
+
+    def __init__(self, context, level=0, prettifier=None):
+        super().__init__(context, level)
+        self.prettifier = prettifier
+
+    def wait(self, ready):
+        """Parse the document until ready() is true or this element is closed"""
+        prettifier = self.prettifier
+        while not ready() and prettifier.is_open(self.context, self.level):
+            prettifier.parse_more()
+
+    def is_self_closing(self):
+        """Is this element self closing?"""
+        if not self.is_tag():
+            raise ValueError("This is not a tag")
+        contents = self.context.contents
+        self.wait(lambda: contents)
+        return not contents
+
+    def starts_with_text(self):
+        """Check if the first child of this element is a text"""
+        contents = self.context.contents
+        return bool(contents) and self.__class__(contents[0]).kind == TEXT
+
+    @property
+    def preserve_text_whitespace(self):
+        if self._preserve_text_whitespace is None:
+            contents = self.context.contents
+            self._preserve_text_whitespace = False
+            if self.tag in self.preserve_text_whitespace_elements:
+                self.wait(
+                    lambda: len(contents) > 1
+                    or (contents and not self.starts_with_text())
+                )
+                self._preserve_text_whitespace = (
+                    len(contents) == 1 and self.starts_with_text()
+                )
+        return self._preserve_text_whitespace
+
+    def getchildren(self):
+        """Yield the children of this element as soon as they can be rendered
+
+        A doctype is rendered only when we know what follows it.
+        Each child is removed from the tree when the next one is requested,
+        i.e. when it has been written, so that its memory can be freed.
+        """
+        contents = self.context.contents
+        next_level = self.level + 1
+        while True:
+            self.wait(lambda: contents)
+            if not contents:
+                return
+            child = self.__class__(contents[0], next_level, self.prettifier)
+            if child.kind == DOCTYPE:
+                self.wait(lambda: len(contents) > 1)
+            yield child
+            contents[0].extract()
+
+
+class StreamingXMLPrettifier(XMLPrettifier):
+    """Prettify huge XML documents keeping in memory only the open elements
+
+    The input is read in blocks of block_size characters
+    only when the rendering needs them,
+    and every element is removed from the tree as soon as it has been written,
+    so that the memory used depends on the depth of the document
+    and not on its size.
+    The result is the same of XMLPrettifier.
+    """
+
+    pretty_element = StreamingXMLElement
+    block_size = 2**16
+    # What _prepare_pattern can match across many lines
+    _open_pattern = re.compile(r"<!\[CDATA\[|(?i:<!DOCTYPE)")
+
+    def __init__(self, filename="", text="", encoding="utf8", jobs=1):
+        """Create a prettifier instance that will read its contents
+        from a text or a filename ("-" means the standard input)
+
+        jobs is accepted for compatibility with the other prettifiers,
+        but the document is always rendered by this process.
+        """
+        self.jobs = jobs
+        self.repaired_tags = []
+        self._cdatas = deque()
+        self._doctype = None
+        self._entity_mapping = {}
+        self._entity_markers = {}
+        self.encoding = encoding
+        self.filename = filename
+        self._blocks = self.iter_blocks(filename, text)
+        # The input that has been read but not yet parsed
+        self._pending = ""
+        self._continued = False
+        # The blocks read before the document has any content, see iter_render
+        self._kept = deque()
+        self._keep_blocks = False
+        self.soup = StreamingSoup(self)
+        self.root = self.pretty_element(self.soup, -1, self)
+
+    def iter_blocks(self, filename, text):
+        """Yield the input in blocks of block_size characters"""
+        if not filename:
+            if not isinstance(text, str):
+                text = text.decode(self.encoding)
+            for idx in range(0, len(text), self.block_size):
+                yield text[idx : idx + self.block_size]
+        elif filename == "-":
+            yield from iter(partial(stdin.read, self.block_size), "")
+        else:
+            with open(filename) as f:
+                yield from iter(partial(f.read, self.block_size), "")
+
+    def _prepared_end(self, text):
+        """Return the length of the start of text
+        that can be prepared without knowing what follows it
+
+        The text is cut after a ">", that cannot be part of an entity,
+        but not inside a CDATA or a doctype that may end in the next blocks.
+        The cut happens in the middle of a line that is not blank.
+        """
+        limit = len(text)
+        position = 0
+        while True:
+            match = self._open_pattern.search(text, position)
+            if match is None:
+                break
+            prepared = self._prepare_pattern.match(text, match.start())
+            if prepared is None or prepared.lastgroup not in ("cdata", "doctype"):
+                limit = match.start()
+                break
+            position = prepared.end()
+        return text.rfind(">", 0, limit) + 1
+
+    def _prepare_piece(self, text):
+        """Prepare a piece of the input like _prepare_text prepares the whole text
+
+        The pieces after the first one start in the middle of a line
+        that is not blank (see _prepared_end).
+        """
+        text = self._prepare_pattern.sub(self._prepare_match, text)
+        lines = text.splitlines()
+        prepared = [line if line.strip() else self._newlines_marker for line in lines]
+        if self._continued and lines:
+            prepared[0] = lines[0]
+        text = "\n".join(prepared)
+        if not self._continued and text.startswith("\N{BYTE ORDER MARK}"):
+            # BeautifulSoup strips it as well
+            text = text[1:]
+        self._continued = True
+        return text
+
+    def parse_more(self):
+        """Parse the next block of the input
+
+        Return False if the whole input has been parsed already
+        """
+        soup = self.soup
+        if soup.closed:
+            return False
+        block = next(self._blocks, "")
+        if self._kept is not None:
+            self._kept.append(block)
+        if block:
+            pending = self._pending + block
+            end = self._prepared_end(pending)
+            text, self._pending = pending[:end], pending[end:]
+        else:
+            text, self._pending = self._pending, ""
+        if text or not block:
+            # Like LXMLTreeBuilderForXML.feed, feed the parser at least once
+            soup.feed(self._prepare_piece(text))
+        if not block:
+            soup.close()
+        return True
+
+    def is_open(self, tag, level):
+        """Check if the tag at the given level can still get some content"""
+        return self.soup.is_open(tag, level)
+
+    def restorer(self):
+        """Return a function that restores the markers added while parsing
+
+        The CDATAs are forgotten as soon as they are restored
+        """
+        cdatas = self._cdatas
+        entities = self._entity_markers
+
+        def restore(match):
+            kind = match.lastgroup
+            if kind == "newline":
+                return ""
+            if kind == "ampersand":
+                return "&"
+            if kind == "entity":
+                return entities.get(match.group(), match.group())
+            if kind == "cdata":
+                if cdatas:
+                    return f"<![CDATA[{cdatas.popleft()}]]>"
+            elif self._doctype:
+                return self._doctype
+            return match.group()
+
+        return partial(self._restore_pattern.sub, restore)
+
+    def iter_render(self, size=1024):
+        """Yield the prettified text in pieces while the input is read
+
+        See ZPrettifier.iter_render
+        """
+        root = self.root
+        contents = root.context.contents
+        root.wait(lambda: contents)
+        if not contents:
+            # The input is not even something that looks like an XML
+            text = "".join(self._kept)
+            if text:
+                yield text
+            return
+        if not self._keep_blocks:
+            self._kept = None
+        restore = self.restorer()
+        last = ""
+        for piece in root.iter_render(size):
+            piece = restore(piece)
+            if piece:
+                last = piece
+                yield piece
+        if self._end_with_newline and not last.endswith("\n"):
+            yield "\n"
+
+    def iter_original(self):
+        """Yield the blocks of the original text, reading them if needed"""
+        kept = self._kept
+        while True:
+            while kept:
+                yield kept.popleft()
+            if not self.parse_more():
+                return
+
+    def first_difference(self):
+        """Return the line and the column where the prettified text
+        differs for the first time from the original one,
+        None if the original text is already prettified
+
+        The input is read only once and only until a difference is found.
+        """
+        self._keep_blocks = True
+        return first_difference(self.iter_original(), self.iter_render())
+
+    def __call__(self):
+        return "".join(self.iter_render())
@@ -1,5 +1,5 @@
-from bs4 import BeautifulSoup
 from logging import getLogger
+from zpretty.xml import attribute_ranks
 from zpretty.xml import XMLAttributes
 from zpretty.xml import XMLElement
 from zpretty.xml import XMLPrettifier
@@ -466,8 +466,23 @@ class ZCMLAttributes(XMLAttributes):
         "layer",
     )
 
-    @property
-    def _xml_attribute_order(self):
+    @classmethod
+    def _build_ranks(cls):
+        """Precompute the tables used to sort the attributes of this class
+
+        The attribute orders are compiled in dicts keyed by (namespace, tag)
+        """
+        super()._build_ranks()
+        cls._xml_attribute_ranks_by_ns_and_tag = {
+            (ns, tag): attribute_ranks(order)
+            for ns, orders in cls._xml_attribute_order_by_ns_and_tag.items()
+            for tag, order in orders.items()
+        }
+        cls._xml_attribute_ranks_fallback = attribute_ranks(
+            cls._xml_attribute_order_fallback
+        )
+
+    def xml_attribute_ranks(self):
         """Sort the attributes based on the element
 
         _xml_attribute_order_by_ns_and_tag comments contain references
@@ -483,14 +498,12 @@ class ZCMLAttributes(XMLAttributes):
           where the title is sorted after the menu attribute)
         """
         try:
-            ns = self.element.context.namespace
-            name = self.element.context.name
+            key = (self.element.context.namespace, self.element.context.name)
         except AttributeError:
-            ns = ""
-            name = ""
-
-        mapping_by_namespace = self._xml_attribute_order_by_ns_and_tag.get(ns, {})
-        return mapping_by_namespace.get(name, self._xml_attribute_order_fallback)
+            key = ("", "")
+        return self._xml_attribute_ranks_by_ns_and_tag.get(
+            key, self._xml_attribute_ranks_fallback
+        )
 
     def format_multiline(self, name, value):
         """We have two cases according if we have just one attribute or more
@@ -531,7 +544,7 @@ class ZCMLAttributes(XMLAttributes):
         """Actually we do not want to remove the spaces"""
         return self()
 
-    def __call__(self):
+    def render(self):
         """Render the attributes as text
 
         Render and an empty string if no attributes
@@ -554,6 +567,7 @@ class ZCMLAttributes(XMLAttributes):
 
 
 class ZCMLElement(XMLElement):
+    __slots__ = ()
     before_closing_multiline = "    "
     attribute_klass = ZCMLAttributes
 
@@ -575,5 +589,5 @@ class ZCMLPrettifier(XMLPrettifier):
         markup = "<{null}>{text}</{null}>".format(
             null=self.pretty_element.null_tag_name, text=text
         )
-        wrapped_soup = BeautifulSoup(markup, self.parser)
+        wrapped_soup = self.parse(markup)
         return getattr(wrapped_soup, self.pretty_element.null_tag_name)